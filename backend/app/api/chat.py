@@ -1,22 +1,61 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query
 from fastapi.responses import StreamingResponse
+from app.core.config import settings
 from app.models.chat_model import ChatMessage
 from app.services.chat_service import chat_service
+from app.services.llm_scheduler import QueueFullError
+from app.services.stream_output import MEDIA_TYPES, output_stage
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# ndjson is what the frontend reads; ?format=sse frames the same events for EventSource-style clients
+OUTPUT_FORMAT = Query("ndjson", alias="format", pattern="^(ndjson|sse)$")
+
+# The tenant comes from the API key, never from the client directly; requests without a known key
+# share the "default" tenant. X-Priority is only a request, clamped to what the tenant is allowed
+API_KEY = Header(None, alias="X-API-Key")
+PRIORITY = Header(0, alias="X-Priority")
+
+def scheduling_identity(api_key, priority):
+    """(tenant, priority) for the scheduler: the highest allowed priority not above the one asked for."""
+    tenant = settings.TENANT_API_KEYS.get(api_key, "default") if api_key else "default"
+    allowed = settings.TENANT_PRIORITIES.get(tenant) or [0]
+    lower = [level for level in allowed if level <= priority]
+    return tenant, max(lower) if lower else min(allowed)
+
+def admit():
+    try:
+        chat_service.scheduler.check_admission()
+    except QueueFullError as e:
+        logger.warning(f"Rejecting chat request: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail={"message": "The server is busy, please retry later", "queue_position": e.position, "retry_after": e.retry_after},
+            headers={"Retry-After": str(e.retry_after)},
+        ) from None
+
+def stream_response(events, output_format):
+    return StreamingResponse(
+        output_stage.stream(events, output_format),
+        media_type=MEDIA_TYPES[output_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.options("/chat")
 async def chat_options():
     return {"allow": "POST"}
 
 @router.post("/chat")
-async def chat(message: ChatMessage):
+async def chat(message: ChatMessage, output_format: str = OUTPUT_FORMAT, api_key: str = API_KEY, priority: int = PRIORITY):
     try:
-        logger.info(f"Received request to /chat with message: {message.message}")
-        return StreamingResponse(chat_service.generate_response(message), media_type="text/event-stream")
+        tenant, priority = scheduling_identity(api_key, priority)
+        logger.info(f"Received request to /chat ({len(message.message)} chars)")
+        admit()
+        events = chat_service.generate_response(message, tenant=tenant, priority=priority)
+        return stream_response(events, output_format)
     except HTTPException as he:
         logger.error(f"HTTP exception in /chat endpoint: {str(he)}", exc_info=True)
         raise he
@@ -29,10 +68,14 @@ async def chat_with_history_options(conversation_id: str):
     return {"allow": "POST"}
 
 @router.post("/chat/{conversation_id}")
-async def chat_with_history(conversation_id: str, message: ChatMessage):
+async def chat_with_history(conversation_id: str, message: ChatMessage, output_format: str = OUTPUT_FORMAT,
+                            api_key: str = API_KEY, priority: int = PRIORITY):
     try:
+        tenant, priority = scheduling_identity(api_key, priority)
         logger.info(f"Received request for conversation ID: {conversation_id}")
-        return StreamingResponse(chat_service.generate_response(message, conversation_id), media_type="text/event-stream")
+        admit()
+        events = chat_service.generate_response(message, conversation_id, tenant=tenant, priority=priority)
+        return stream_response(events, output_format)
     except HTTPException as he:
         logger.error(f"HTTP exception in /chat/{{conversation_id}} endpoint: {str(he)}", exc_info=True)
         raise he
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -5,7 +6,116 @@ class Settings(BaseSettings):
     BRAVE_API: str
     MISTRAL_API_KEY: str
 
+    # Upstream base URLs, one pooled client each
+    OPENAI_BASE_URL: str = "https://api.openai.com/v1"
+    BRAVE_BASE_URL: str = "https://api.search.brave.com/res/v1"
+    PORTFOLIO_BASE_URL: str = "https://stage.illio.com/api/v3"
+    RECORDS_BASE_URL: str = "http://localhost:5000"
+
+    # Connection pool (limits apply per upstream)
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_TIMEOUT: float = 30.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP2_ENABLED: bool = False
+
+    # Tool execution defaults, overridable per tool in FunctionHandler
+    TOOL_MAX_CONCURRENCY: int = 8
+    TOOL_TIMEOUT: float = 20.0
+    TOOL_CACHE_TTL: float = 300.0
+    TOOL_CACHE_MAX_ENTRIES: int = 256
+    # Tool results are compacted and cut to this size before entering the conversation
+    TOOL_OUTPUT_MAX_BYTES: int = 12000
+    BRAVE_MAX_RESULTS: int = 5
+
+    # Conversation store: "memory" (single process), "sqlite" (WAL database) or "redis".
+    # With a shared backend the entry/byte limits apply to each worker's local read cache.
+    CONVERSATION_BACKEND: str = "memory"
+    CONVERSATION_SQLITE_PATH: str = "/tmp/conversations.db"
+    CONVERSATION_REDIS_URL: str = "redis://localhost:6379/0"
+    CONVERSATION_MAX_ENTRIES: int = 1000
+    CONVERSATION_MAX_BYTES: int = 256 * 1024 * 1024
+    CONVERSATION_IDLE_TTL: float = 3600.0
+    # Parent of the per-conversation session folders; must be shared storage when workers span nodes
+    SESSION_ROOT: str = "/tmp"
+
+    # Prompt budget for each completion request; older turns are compacted or dropped
+    CONTEXT_TOKEN_BUDGET: int = 16000
+    CONTEXT_STALE_TOOL_TOKENS: int = 200
+
+    # Shared content-addressed store for downloaded records; least recently used blobs are evicted
+    # beyond the byte cap, and blobs unused for the TTL (seconds) are evicted too (0 = no limit)
+    BLOB_STORE_DIR: str = "/tmp/blob_store"
+    BLOB_STORE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+    BLOB_STORE_TTL: float = 7 * 24 * 3600
+    DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+
+    # Worker pool for assess_file ("process" or "thread")
+    ASSESS_POOL_KIND: str = "process"
+    ASSESS_POOL_WORKERS: int = 2
+    ASSESS_POOL_MAX_QUEUE: int = 32
+    ASSESS_FILE_TIMEOUT: float = 20.0
+
+    # Speculative download + assessment of the files listed by query_medical_records;
+    # the byte rate applies until a tool call waits on the prefetch (0 = unlimited)
+    PREFETCH_ENABLED: bool = True
+    PREFETCH_MAX_CONCURRENCY: int = 2
+    PREFETCH_MAX_BYTES_PER_SECOND: int = 4 * 1024 * 1024
+
+    # search_session_documents: extracted text is cached here by file hash, results are cut to the token budget
+    DOCUMENT_TEXT_CACHE_DIR: str = "/tmp/document_text"
+    DOCUMENT_SEARCH_MAX_RESULTS: int = 10
+    DOCUMENT_SEARCH_TOKEN_BUDGET: int = 1500
+
+    # Completion request scheduling; the per-minute budgets follow OpenAI's x-ratelimit-* headers once seen
+    LLM_MAX_CONCURRENCY: int = 32
+    LLM_MAX_QUEUE: int = 200
+    LLM_REQUESTS_PER_MINUTE: int = 500
+    LLM_TOKENS_PER_MINUTE: int = 200000
+    LLM_MAX_RETRIES: int = 4
+    LLM_BACKOFF_BASE: float = 0.5
+    LLM_BACKOFF_MAX: float = 20.0
+    # Tokens reserved per request on top of the prompt when charging the tokens budget
+    LLM_COMPLETION_TOKENS_ESTIMATE: int = 500
+    # Scheduling tenant for each API key sent as X-API-Key (JSON object), and the X-Priority values
+    # each tenant may use; anything else, including requests without a known key, is clamped into these
+    TENANT_API_KEYS: dict[str, str] = {}
+    TENANT_PRIORITIES: dict[str, list[int]] = {"default": [0]}
+
+    # Exact-match cache of whole chat responses (off by default); responses that called a
+    # time-sensitive tool or a tool without result caching are never stored
+    COMPLETION_CACHE_ENABLED: bool = False
+    COMPLETION_CACHE_TTL: float = 3600.0
+    COMPLETION_CACHE_MAX_ENTRIES: int = 1000
+    COMPLETION_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # Response streaming: content deltas are merged for up to this long / this many bytes per frame
+    STREAM_FLUSH_INTERVAL: float = 0.03
+    STREAM_FLUSH_BYTES: int = 4096
+    # Frames buffered per response before a client counts as slow, and how long it may stay slow
+    STREAM_MAX_BUFFERED_FRAMES: int = 64
+    STREAM_SLOW_CLIENT_TIMEOUT: float = 10.0
+
+    # Logging: messages longer than this are truncated; below WARNING only this fraction is kept
+    LOG_LEVEL: str = "INFO"
+    LOG_MAX_MESSAGE_CHARS: int = 2000
+    LOG_SAMPLE_RATE: float = 1.0
+
+    # Import PyMuPDF/PIL in the lifespan hook instead of on the first tool call
+    PREWARM_IMPORTS: bool = False
+
     class Config:
         env_file = ".env"
 
-settings = Settings()
+@lru_cache
+def get_settings():
+    return Settings()
+
+class LazySettings:
+    """Builds Settings on first attribute access rather than at import time."""
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+settings = LazySettings()
@@ -0,0 +1,72 @@
+import atexit
+import collections
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+class TruncateAndSample(logging.Filter):
+    """Drops a sample of sub-WARNING records and truncates long messages before they are queued."""
+
+    def __init__(self, max_chars, sample_rate):
+        super().__init__()
+        self.max_chars = max_chars
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        message = record.getMessage()
+        if len(message) > self.max_chars:
+            record.msg = f"{message[:self.max_chars]}... [{len(message) - self.max_chars} more chars]"
+            record.args = None
+        return True
+
+class EarlyLogBuffer(logging.Handler):
+    """Keeps the last `capacity` records logged before setup_logging runs."""
+
+    def __init__(self, capacity):
+        super().__init__()
+        self.records = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+def buffer_early_logs(capacity=1000):
+    """Hold records from imports and __main__ until setup_logging knows the level and handlers."""
+    root = logging.getLogger()
+    if root.handlers:
+        return  # configured already, e.g. by a --log-config
+    root.addHandler(EarlyLogBuffer(capacity))
+    root.setLevel(logging.DEBUG)
+
+def setup_logging(level="INFO", max_chars=2000, sample_rate=1.0):
+    """Route root logging through a queue so request handlers never block on the log stream.
+
+    Records are formatted and written by a QueueListener thread; the returned
+    listener is stopped at interpreter exit, flushing anything still queued.
+    Records held by buffer_early_logs are replayed at the new level.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(TruncateAndSample(max_chars, sample_rate))
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    early = [handler for handler in root.handlers if isinstance(handler, EarlyLogBuffer)]
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for handler in early:
+        for record in handler.records:
+            if root.isEnabledFor(record.levelno):
+                queue_handler.handle(record)
+    return listener
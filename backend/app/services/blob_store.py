@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import weakref
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class BlobStore:
+    """Content-addressed store for downloaded files, shared by every session.
+
+    Blobs live at blobs/<sha256[:2]>/<sha256> and are linked into session
+    folders. refs/ remembers which blob (and ETag) a URL last resolved to so
+    repeat downloads can be revalidated with If-None-Match, and partial/
+    keeps interrupted transfers so they can resume with a Range request.
+
+    The store is kept under `max_bytes` by evicting least recently used
+    blobs, and blobs unused for `ttl` seconds are evicted too (0 disables
+    either limit). Session folders hold their own links, so evicting a blob
+    only means the next download of it goes to the network again. All file
+    I/O runs in worker threads.
+    """
+
+    def __init__(self, root, chunk_size=64 * 1024, max_bytes=0, ttl=0):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        for folder in ("blobs", "refs", "partial"):
+            os.makedirs(os.path.join(root, folder), exist_ok=True)
+        # One lock per URL, dropped once no fetch holds or waits on it
+        self.locks = weakref.WeakValueDictionary()
+        # Linking a blob and evicting one never overlap
+        self.gc_lock = asyncio.Lock()
+        self.blobs = None  # sha256 -> (size, last used), least recently used first; scanned on first use
+        self.total_bytes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, "blobs", sha256[:2], sha256)
+
+    def _read_json(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_json(self, path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def link(self, sha256, dest_path):
+        """Expose a blob at dest_path, hardlinked when the filesystem allows it."""
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(self.blob_path(sha256), dest_path)
+        except OSError:
+            shutil.copyfile(self.blob_path(sha256), dest_path)
+
+    async def fetch(self, client, url, dest_path, throttle=None):
+        """Download url into dest_path through the store and return transfer stats.
+
+        throttle, if given, is awaited with the size of every chunk received.
+        """
+        key = self._key(str(client.base_url.join(url)))
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        async with lock:
+            result = await self._fetch(client, url, key, dest_path, throttle)
+            if result is None:
+                # The blob the ref pointed to was evicted (by another worker) after revalidation
+                result = await self._fetch(client, url, key, dest_path, throttle, revalidate=False)
+        await self._collect(keep=result["sha256"])
+        return result
+
+    async def _fetch(self, client, url, key, dest_path, throttle=None, revalidate=True):
+        start = time.perf_counter()
+        ref_path = os.path.join(self.root, "refs", f"{key}.json")
+        partial_path = os.path.join(self.root, "partial", f"{key}.part")
+        partial_meta_path = os.path.join(self.root, "partial", f"{key}.json")
+
+        ref, partial_meta, resume_from, have_blob = await asyncio.to_thread(
+            self._load_state, ref_path, partial_path, partial_meta_path
+        )
+        have_partial = bool(resume_from or partial_meta)
+        headers = {}
+        if revalidate and have_blob and ref.get("etag"):
+            headers["If-None-Match"] = ref["etag"]
+        if resume_from and partial_meta and partial_meta.get("etag"):
+            headers["Range"] = f"bytes={resume_from}-"
+            headers["If-Range"] = partial_meta["etag"]
+        else:
+            resume_from = 0
+
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304:
+                if have_partial:
+                    # Our blob is current, so an interrupted transfer of another version is useless
+                    await asyncio.to_thread(self._discard_partial, partial_path, partial_meta_path)
+                async with self.gc_lock:
+                    try:
+                        await asyncio.to_thread(self.link, ref["sha256"], dest_path)
+                    except FileNotFoundError:
+                        return None
+                    self._touch(ref["sha256"], ref["size"])
+                return self._result(dest_path, ref["sha256"], ref["size"], 0, start, cached=True)
+            if response.is_error:
+                # Read the body so callers can report it from the HTTPStatusError
+                await response.aread()
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                # Seed the hash with the bytes we already have
+                hasher = await asyncio.to_thread(self._hash_file, partial_path)
+                mode = "ab"
+            else:
+                hasher = hashlib.sha256()
+                resume_from = 0
+                mode = "wb"
+
+            etag = response.headers.get("ETag")
+            await asyncio.to_thread(self._write_json, partial_meta_path, {"etag": etag})
+            transferred = 0
+            f = await asyncio.to_thread(open, partial_path, mode)
+            try:
+                async for chunk in response.aiter_bytes(self.chunk_size):
+                    await asyncio.to_thread(f.write, chunk)
+                    hasher.update(chunk)
+                    transferred += len(chunk)
+                    if throttle is not None:
+                        await throttle(len(chunk))
+            finally:
+                await asyncio.to_thread(f.close)
+
+        sha256 = hasher.hexdigest()
+        size = resume_from + transferred
+        async with self.gc_lock:
+            cached = await asyncio.to_thread(
+                self._commit, partial_path, partial_meta_path, ref_path, sha256, etag, size, dest_path
+            )
+            self._touch(sha256, size)
+        if resume_from:
+            logger.info(f"Resumed download of {url} at byte {resume_from}")
+        return self._result(dest_path, sha256, size, transferred, start, cached=cached)
+
+    def _load_state(self, ref_path, partial_path, partial_meta_path):
+        ref = self._read_json(ref_path)
+        have_blob = bool(ref) and os.path.exists(self.blob_path(ref["sha256"]))
+        partial_meta = self._read_json(partial_meta_path)
+        resume_from = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        return ref, partial_meta, resume_from, have_blob
+
+    @staticmethod
+    def _discard_partial(partial_path, partial_meta_path):
+        for path in (partial_path, partial_meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _hash_file(self, path):
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(self.chunk_size), b""):
+                hasher.update(block)
+        return hasher
+
+    def _commit(self, partial_path, partial_meta_path, ref_path, sha256, etag, size, dest_path):
+        """Move a finished download into blobs/ and link it; True if the blob was already there."""
+        blob_path = self.blob_path(sha256)
+        cached = os.path.exists(blob_path)
+        if cached:
+            # Same content already stored under another URL or an older ETag
+            os.remove(partial_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(partial_path, blob_path)
+            # Blobs are shared through hardlinks, so they must never be modified in place
+            os.chmod(blob_path, 0o444)
+        os.remove(partial_meta_path)
+        self._write_json(ref_path, {"etag": etag, "sha256": sha256, "size": size})
+        self.link(sha256, dest_path)
+        return cached
+
+    def _scan(self):
+        """(sha256, size, mtime) of every stored blob, oldest first."""
+        blobs = []
+        blobs_dir = os.path.join(self.root, "blobs")
+        for prefix in os.scandir(blobs_dir):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                stat = entry.stat()
+                blobs.append((entry.name, stat.st_size, stat.st_mtime))
+        blobs.sort(key=lambda blob: blob[2])
+        return blobs
+
+    def _touch(self, sha256, size):
+        if self.blobs is None:
+            return
+        if sha256 in self.blobs:
+            self.total_bytes -= self.blobs[sha256][0]
+        self.blobs[sha256] = (size, time.time())
+        self.blobs.move_to_end(sha256)
+        self.total_bytes += size
+
+    async def _collect(self, keep=None):
+        """Evict least recently used blobs over max_bytes, and blobs idle for longer than ttl."""
+        if not self.max_bytes and not self.ttl:
+            return
+        async with self.gc_lock:
+            if self.blobs is None:
+                self.blobs = OrderedDict()
+                for sha256, size, mtime in await asyncio.to_thread(self._scan):
+                    self.blobs[sha256] = (size, mtime)
+                    self.total_bytes += size
+            cutoff = time.time() - self.ttl if self.ttl else None
+            evict = []
+            total = self.total_bytes
+            for sha256, (size, last_used) in self.blobs.items():
+                over_size = self.max_bytes and total > self.max_bytes
+                expired = cutoff is not None and last_used < cutoff
+                if not over_size and not expired:
+                    break
+                if sha256 == keep:
+                    continue
+                evict.append(sha256)
+                total -= size
+            if not evict:
+                return
+            await asyncio.to_thread(self._remove, evict)
+            for sha256 in evict:
+                self.total_bytes -= self.blobs.pop(sha256)[0]
+            self.evictions += len(evict)
+            logger.info(f"Evicted {len(evict)} blobs, {self.total_bytes} bytes stored")
+
+    def _remove(self, blobs):
+        for sha256 in blobs:
+            try:
+                os.remove(self.blob_path(sha256))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        return {
+            "blobs": len(self.blobs) if self.blobs is not None else None,
+            "bytes": self.total_bytes if self.blobs is not None else None,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "downloads_in_progress": sum(lock.locked() for lock in list(self.locks.values())),
+        }
+
+    @staticmethod
+    def _result(path, sha256, size, transferred, start, cached):
+        elapsed = time.perf_counter() - start
+        return {
+            "path": path,
+            "sha256": sha256,
+            "bytes": size,
+            "transferred": transferred,
+            "seconds": round(elapsed, 3),
+            "throughput_mb_s": round(transferred / elapsed / 1e6, 2) if elapsed > 0 else None,
+            "cached": cached,
+        }
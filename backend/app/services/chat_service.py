@@ -1,166 +1,420 @@
+import asyncio
 import json
-import httpx
 import logging
 import uuid
 import os
 import shutil
+import time
+import httpx
 from fastapi import HTTPException
 from app.core.config import settings
 from app.models.chat_model import ChatMessage
+from app.services.completion_cache import CompletionCache
+from app.services.context_manager import ContextManager
+from app.services.conversation_log import create_conversation_log
+from app.services.conversation_store import ConversationStore, StoredMessage, encode_message
 from app.services.function_handler import function_handler
+from app.services.llm_scheduler import RETRYABLE_STATUS, LLMScheduler
+from app.services.metrics import (
+    CHAT_REQUESTS, CHAT_RESPONSE_DURATION, CHAT_TURNS, COMPLETION_CACHE_LOOKUPS,
+    COMPLETION_CACHE_STORES, COMPLETION_TOKENS_PER_SECOND, COMPLETION_TTFT, LLM_RETRIES, LLM_SCHEDULER_WAIT,
+    TOOL_LATENCY, UPSTREAM_CONNECT, UPSTREAM_HEADERS,
+)
+from app.services.tool_call_assembler import ToolCallAssembler
 
 logger = logging.getLogger(__name__)
 
+MODEL = "gpt-4o-mini"
+
 class ChatService:
     def __init__(self):
-        self.base_folder = "/tmp"
-        os.makedirs(self.base_folder, exist_ok=True)
         self.extra_context = """
 You are a helpful assistant agent. 
 
 - You can call functions to get additional information when needed. Don't call the same function multiple times in a row.
 - When asked to assess medical records, check the records once, then think about how to download them via another function call, and assess them with a third function call.
+- To answer questions about what downloaded documents say, use search_session_documents instead of assessing them again.
 - All files related to this session are stored in the session folder. You can access this folder path using the 'session_folder' variable.
 - Respond in markdown format
 """
-        self.conversations = {}
+        # Encoded once and shared by every conversation; they open every request body
+        self.system_messages = [
+            StoredMessage("system", encode_message({"role": "system", "content": "You are a helpful assistant who can provide various information, including the current time."})),
+            StoredMessage("system", encode_message({"role": "system", "content": self.extra_context})),
+        ]
+        self._request_prefix = None
+        self._request_prefix_tools = None
+        # Built from settings on first use (see the properties below), not when this module is imported
+        self._conversations = None
+        self._context = None
+        self._scheduler = None
+        self._completion_cache = None
         self.max_turns = 5  # Maximum number of conversation turns
+        self.http_pool = None  # HTTPClientPool, injected by the app lifespan
+
+    @property
+    def base_folder(self):
+        return settings.SESSION_ROOT
+
+    @property
+    def conversations(self):
+        if self._conversations is None:
+            self._conversations = ConversationStore(
+                max_entries=settings.CONVERSATION_MAX_ENTRIES,
+                max_bytes=settings.CONVERSATION_MAX_BYTES,
+                idle_ttl=settings.CONVERSATION_IDLE_TTL,
+                on_evict=lambda conversation: self.cleanup_session_folder(conversation.conversation_id),
+                on_release=lambda conversation: self.release_session(conversation.conversation_id),
+                log=create_conversation_log(
+                    settings.CONVERSATION_BACKEND,
+                    settings.CONVERSATION_SQLITE_PATH,
+                    settings.CONVERSATION_REDIS_URL,
+                    settings.CONVERSATION_IDLE_TTL,
+                ),
+            )
+        return self._conversations
+
+    @property
+    def context(self):
+        if self._context is None:
+            self._context = ContextManager(
+                token_budget=settings.CONTEXT_TOKEN_BUDGET,
+                stale_tool_tokens=settings.CONTEXT_STALE_TOOL_TOKENS,
+            )
+        return self._context
+
+    @property
+    def scheduler(self):
+        if self._scheduler is None:
+            self._scheduler = LLMScheduler(
+                max_concurrency=settings.LLM_MAX_CONCURRENCY,
+                max_queue=settings.LLM_MAX_QUEUE,
+                requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+                tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+                max_retries=settings.LLM_MAX_RETRIES,
+                backoff_base=settings.LLM_BACKOFF_BASE,
+                backoff_max=settings.LLM_BACKOFF_MAX,
+            )
+        return self._scheduler
+
+    @property
+    def completion_cache(self):
+        """The CompletionCache, or None when COMPLETION_CACHE_ENABLED is off."""
+        if self._completion_cache is None and settings.COMPLETION_CACHE_ENABLED:
+            self._completion_cache = CompletionCache(
+                ttl=settings.COMPLETION_CACHE_TTL,
+                max_entries=settings.COMPLETION_CACHE_MAX_ENTRIES,
+                max_bytes=settings.COMPLETION_CACHE_MAX_BYTES,
+            )
+        return self._completion_cache
 
     def create_session_folder(self, conversation_id):
         session_folder = os.path.join(self.base_folder, conversation_id)
         os.makedirs(session_folder, exist_ok=True)
         return session_folder
 
-    def cleanup_session_folder(self, conversation_id):
+    def release_session(self, conversation_id):
+        """Drop this worker's prefetches and search index for a session; its folder stays."""
         session_folder = os.path.join(self.base_folder, conversation_id)
+        function_handler.prefetcher.discard(session_folder)
+        function_handler.documents.discard(session_folder)
+        return session_folder
+
+    def cleanup_session_folder(self, conversation_id):
+        session_folder = self.release_session(conversation_id)
         if os.path.exists(session_folder):
             shutil.rmtree(session_folder)
 
-    async def generate_response(self, chat_message: ChatMessage, conversation_id: str = None):
+    async def generate_response(self, chat_message: ChatMessage, conversation_id: str = None,
+                                tenant: str = "default", priority: int = 0):
+        """Yield the response as event dicts; framing and encoding happen in the output stage."""
+        start = time.perf_counter()
+        pinned = None
+        turns_used = 0
+        outcome = "error"
         try:
-            logger.info(f"Generating response for message: {chat_message.message}, conversation_id: {conversation_id}")
+            logger.info(f"Generating response ({len(chat_message.message)} chars) for conversation_id: {conversation_id}")
             
             if conversation_id is None:
                 conversation_id = str(uuid.uuid4())
                 session_folder = self.create_session_folder(conversation_id)
-                self.conversations[conversation_id] = {
-                    "messages": [
-                        {"role": "system", "content": "You are a helpful assistant who can provide various information, including the current time."},
-                        {"role": "system", "content": self.extra_context},
-                        {"role": "system", "content": f"The session folder for this conversation is: {session_folder}"}
-                    ],
-                    "session_folder": session_folder
-                }
+                # Pinned before it exists: it must survive other requests while the client reads its id
+                self.conversations.pin(conversation_id)
+                pinned = conversation_id
+                conversation = await self.conversations.create(conversation_id, session_folder, [
+                    *self.system_messages,
+                    {"role": "system", "content": f"The session folder for this conversation is: {session_folder}"}
+                ])
                 logger.info(f"Created new conversation with ID: {conversation_id}")
-                yield json.dumps({"type": "conversation_id", "id": conversation_id}) + "\n"
+                yield {"type": "conversation_id", "id": conversation_id}
             else:
-                if conversation_id not in self.conversations:
+                conversation = await self.conversations.get(conversation_id)
+                if conversation is None:
                     raise HTTPException(status_code=404, detail="Conversation not found")
-                session_folder = self.conversations[conversation_id]["session_folder"]
-
-            self.conversations[conversation_id]["messages"].append({"role": "user", "content": chat_message.message})
-            messages = self.conversations[conversation_id]["messages"]
-
-            async with httpx.AsyncClient() as client:
-                logger.info(f"Sending request to OpenAI API for conversation ID: {conversation_id}")
-                
-                full_response = ""
-                for turn in range(self.max_turns):
-                    function_call_name = None
-                    function_call_arguments = ""
-                    turn_response = ""
-
-                    async for chunk in self.stream_chat_completion(client, messages):
-                        if chunk['type'] == 'content':
-                            yield json.dumps({"type": "content", "content": chunk['data']}) + "\n"
-                            turn_response += chunk['data']
-                        elif chunk['type'] == 'function_call':
-                            if 'name' in chunk['data']:
-                                function_call_name = chunk['data']['name']
-                                yield json.dumps({"type": "function_call", "function": function_call_name}) + "\n"
-                            if 'arguments' in chunk['data']:
-                                function_call_arguments += chunk['data']['arguments']
-
-                    full_response += turn_response
-                    logger.info(f"Turn {turn + 1} response: {turn_response}")
-
-                    if function_call_name:
-                        logger.info(f"Function call detected: {function_call_name}")
-                        logger.info(f"Function arguments: {function_call_arguments}")
-                        try:
-                            # Ensure we have a complete JSON object for arguments
-                            while not function_call_arguments.strip().endswith('}'):
-                                async for chunk in self.stream_chat_completion(client, messages):
-                                    if chunk['type'] == 'function_call' and 'arguments' in chunk['data']:
-                                        function_call_arguments += chunk['data']['arguments']
-                                        if function_call_arguments.strip().endswith('}'):
-                                            break
-                            
-                            function_args = json.loads(function_call_arguments)
-                            function_args['session_folder'] = session_folder
-                            function_response = await function_handler.call_function(function_call_name, **function_args)
-                            logger.info(f"Function response: {function_response}")
-                            
-                            yield json.dumps({"type": "function_response", "content": function_response}) + "\n"
-                            
-                            messages.append({
-                                "role": "function",
-                                "name": function_call_name,
-                                "content": function_response
-                            })
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Error parsing function arguments: {str(e)}")
-                            error_message = f"Error parsing function arguments: {str(e)}"
-                            yield json.dumps({"type": "error", "content": error_message}) + "\n"
-                        except Exception as e:
-                            logger.error(f"Error calling function: {str(e)}")
-                            error_message = f"Error calling function: {str(e)}"
-                            yield json.dumps({"type": "error", "content": error_message}) + "\n"
-                    else:
-                        # If no function call, break the loop
-                        break
-
-                self.conversations[conversation_id]["messages"].append({"role": "assistant", "content": full_response})
+                session_folder = conversation.session_folder
+                self.conversations.pin(conversation_id)
+                pinned = conversation_id
+
+            history = conversation.messages
+            await self.conversations.append(conversation_id, {"role": "user", "content": chat_message.message})
+
+            cache_key = None
+            recorded = None
+            if self.completion_cache is not None:
+                cache_key = self.completion_cache.key(MODEL, function_handler.get_tools_payload_bytes(), history, session_folder)
+                cached = self.completion_cache.get(cache_key)
+                COMPLETION_CACHE_LOOKUPS.inc(result="hit" if cached else "miss")
+                if cached is not None:
+                    events, messages = cached.replay(session_folder)
+                    logger.info(f"Replaying cached response for conversation {conversation_id}: {len(events)} events")
+                    await self.conversations.append(conversation_id, *(StoredMessage(role, data) for role, data in messages))
+                    for event in events:
+                        yield event
+                    outcome = "completed"
+                    return
+                recorded = []
+                replay_ttl = self.completion_cache.ttl
+                first_new = len(history)
+
+            def record(event):
+                if recorded is not None:
+                    recorded.append(event)
+                return event
+
+            client = self.http_pool.get("openai")
+            logger.info(f"Sending request to OpenAI API for conversation ID: {conversation_id}")
+            
+            for turn in range(self.max_turns):
+                turns_used = turn + 1
+                assembler = ToolCallAssembler()
+                finish_reason = None
+                turn_response = ""
+
+                context = self.context.build(history)
+                tokens = sum(self.context.count(message) for message in context) + settings.LLM_COMPLETION_TOKENS_ESTIMATE
+                async for chunk in self.stream_chat_completion(client, context, tenant, priority, tokens):
+                    if chunk['type'] == 'content':
+                        yield record({"type": "content", "content": chunk['data']})
+                        turn_response += chunk['data']
+                    elif chunk['type'] == 'tool_call':
+                        for event in assembler.add_delta(chunk['data']):
+                            if event["type"] == "function_call_progress":
+                                # Only useful while the arguments stream in; a replay arrives all at once
+                                yield event
+                            else:
+                                yield record(event)
+                    elif chunk['type'] == 'finish':
+                        finish_reason = chunk['data']
+
+                logger.info(f"Turn {turn + 1}: {len(turn_response)} chars of content, {len(assembler.calls)} tool calls, finish_reason={finish_reason}")
+
+                if assembler.calls:
+                    calls = assembler.finish(finish_reason)
+                    logger.info(f"Tool calls detected: {[call.name for call in calls]}")
+
+                    await self.conversations.append(conversation_id, {
+                        "role": "assistant",
+                        "content": turn_response or None,
+                        "tool_calls": [
+                            {"id": call.id, "type": "function", "function": {"name": call.name, "arguments": call.arguments}}
+                            for call in calls
+                        ]
+                    })
+
+                    results = await asyncio.gather(*(self.run_tool_call(call, session_folder) for call in calls))
+                    tool_messages = []
+                    for call, (function_response, error) in zip(calls, results):
+                        if recorded is not None and replay_ttl is not None:
+                            tool_ttl = None if error else function_handler.replay_ttl(call.name)
+                            replay_ttl = None if tool_ttl is None else min(replay_ttl, tool_ttl)
+                        if error:
+                            yield record({"type": "error", "id": call.id, "content": error})
+                        else:
+                            yield record({"type": "function_response", "id": call.id, "content": function_response})
+                        tool_messages.append({
+                            "role": "tool",
+                            "tool_call_id": call.id,
+                            "content": function_response
+                        })
+                    await self.conversations.append(conversation_id, *tool_messages)
+                else:
+                    # If no tool call, record the final answer and break the loop
+                    await self.conversations.append(conversation_id, {"role": "assistant", "content": turn_response})
+                    outcome = "completed"
+                    if recorded is not None:
+                        if replay_ttl is None:
+                            self.completion_cache.skip()
+                            stored = False
+                        else:
+                            stored = self.completion_cache.put(cache_key, recorded, history[first_new:], session_folder, ttl=replay_ttl)
+                        COMPLETION_CACHE_STORES.inc(outcome="stored" if stored else "skipped")
+                    break
+            else:
+                outcome = "max_turns"
+                logger.warning(f"Conversation {conversation_id} used all {self.max_turns} turns without a final answer")
 
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}", exc_info=True)
-            yield json.dumps({"type": "error", "content": str(e)}) + "\n"
+            yield {"type": "error", "content": str(e)}
+        finally:
+            if pinned is not None:
+                self.conversations.unpin(pinned)
+                # Speculative work nobody is left to use; finished prefetches stay for the next message
+                function_handler.prefetcher.cancel(session_folder)
+            CHAT_REQUESTS.inc(outcome=outcome)
+            CHAT_RESPONSE_DURATION.observe(time.perf_counter() - start)
+            if turns_used:
+                CHAT_TURNS.observe(turns_used)
+
+    async def run_tool_call(self, call, session_folder):
+        """Run one assembled tool call and return (content for the tool message, error or None)."""
+        logger.info(f"Calling {call.name} ({call.id}) with arguments: {call.arguments}")
+        if call.error:
+            logger.error(call.error)
+            return call.error, call.error
+        start = time.perf_counter()
+        try:
+            function_response = await function_handler.call_function(call.name, **dict(call.args, session_folder=session_folder))
+            elapsed = time.perf_counter() - start
+            TOOL_LATENCY.observe(elapsed, tool=call.name, outcome="ok")
+            logger.info(f"Function response ({call.id}): {len(function_response)} chars in {elapsed:.3f} s")
+            return function_response, None
+        except asyncio.TimeoutError:
+            TOOL_LATENCY.observe(time.perf_counter() - start, tool=call.name, outcome="timeout")
+            logger.error(f"Function {call.name} timed out")
+            error_message = f"Error calling function: {call.name} timed out"
+        except Exception as e:
+            TOOL_LATENCY.observe(time.perf_counter() - start, tool=call.name, outcome="error")
+            logger.error(f"Error calling function: {str(e)}")
+            error_message = f"Error calling function: {str(e)}"
+        return error_message, error_message
+
+    def request_prefix(self):
+        """(body up to the messages array, the same plus the shared system messages), rebuilt only if the tools change."""
+        tools = function_handler.get_tools_payload_bytes()
+        if self._request_prefix is None or tools is not self._request_prefix_tools:
+            head = b"".join([
+                b'{"model":"',
+                MODEL.encode("utf-8"),
+                # include_usage adds a final chunk with the completion's token count
+                b'","stream":true,"stream_options":{"include_usage":true},"tool_choice":"auto","tools":',
+                tools,
+                b',"messages":[',
+            ])
+            self._request_prefix = (head, head + b",".join(message.data for message in self.system_messages))
+            self._request_prefix_tools = tools
+        return self._request_prefix
 
-    async def stream_chat_completion(self, client, messages):
+    def build_request_body(self, context):
+        """Request body for a list of StoredMessage, spliced from cached bytes without any JSON encoding."""
+        head, prefix = self.request_prefix()
+        shared = len(self.system_messages)
+        # Conversations loaded from a shared log hold copies, so compare bytes rather than identity
+        if len(context) >= shared and all(
+            message is system or message.data == system.data
+            for message, system in zip(context, self.system_messages)
+        ):
+            parts = [prefix, b","] if len(context) > shared else [prefix]
+            rest = context[shared:]
+        else:
+            parts = [head]
+            rest = context
+        parts.append(b",".join(message.data for message in rest))
+        parts.append(b"]}")
+        return b"".join(parts)
+
+    async def stream_chat_completion(self, client, messages, tenant="default", priority=0, tokens=0):
+        """Stream one completion through the scheduler, retrying failures that happen before any output."""
+        attempt = 0
+        while True:
+            async with self.scheduler.slot(tenant, priority, tokens) as waited:
+                LLM_SCHEDULER_WAIT.observe(waited)
+                try:
+                    async for chunk in self._stream_completion_once(client, messages):
+                        yield chunk
+                    return
+                # Both are raised before the first chunk, so a retry never repeats output
+                except httpx.HTTPStatusError as e:
+                    status = e.response.status_code
+                    if status not in RETRYABLE_STATUS or attempt >= self.scheduler.max_retries:
+                        raise
+                    cause = "rate_limited" if status == 429 else "server_error"
+                    delay = self.scheduler.backoff(attempt, e.response.headers, rate_limited=status == 429)
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                    if attempt >= self.scheduler.max_retries:
+                        raise
+                    cause = "connect"
+                    delay = self.scheduler.backoff(attempt)
+            LLM_RETRIES.inc(cause=cause)
+            logger.warning(f"Retrying completion request ({cause}) in {delay:.2f} s, attempt {attempt + 2} of {self.scheduler.max_retries + 1}")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _stream_completion_once(self, client, messages):
+        body = self.build_request_body(messages)
+        sent = time.perf_counter()
+        connect_started = None
+        # httpcore trace events; a reused keep-alive connection skips the connect ones
+        connected = "connection.start_tls.complete" if client.base_url.scheme == "https" else "connection.connect_tcp.complete"
+
+        async def trace(event, info):
+            nonlocal connect_started
+            if event == "connection.connect_tcp.started":
+                connect_started = time.perf_counter()
+            elif event == connected and connect_started is not None:
+                UPSTREAM_CONNECT.observe(time.perf_counter() - connect_started, upstream="openai")
+            elif event.endswith(".receive_response_headers.complete"):
+                UPSTREAM_HEADERS.observe(time.perf_counter() - sent, upstream="openai")
+
+        first_delta = None
+        completion_tokens = 0
         async with client.stream(
             "POST",
-            "https://api.openai.com/v1/chat/completions",
+            "/chat/completions",
             headers={
                 "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
                 "Content-Type": "application/json"
             },
-            json={
-                "model": "gpt-4o-mini",
-                "messages": messages,
-                "functions": function_handler.get_function_descriptions(),
-                "function_call": "auto",
-                "stream": True
-            },
-            timeout=30.0
+            content=body,
+            extensions={"trace": trace},
         ) as response:
+            self.scheduler.update_from_headers(response.headers)
+            if response.is_error:
+                # Read the body so callers can report it from the HTTPStatusError
+                await response.aread()
             response.raise_for_status()
             async for line in response.aiter_lines():
                 if line.startswith("data: "):
                     line = line[6:]  # Remove "data: " prefix
                 if line.strip() == "[DONE]":
-                    break
+                    # Keep reading to EOF: leaving early closes the connection instead of returning it to the pool
+                    continue
                 if line:
                     try:
                         chunk_data = json.loads(line)
+                        if chunk_data.get("usage"):
+                            completion_tokens = chunk_data["usage"].get("completion_tokens") or 0
                         if "choices" in chunk_data and len(chunk_data["choices"]) > 0:
                             delta = chunk_data["choices"][0].get("delta", {})
 
+                            if first_delta is None and (delta.get("content") is not None or delta.get("tool_calls")):
+                                first_delta = time.perf_counter()
+                                COMPLETION_TTFT.observe(first_delta - sent)
+
                             if "content" in delta and delta["content"] is not None:
                                 yield {"type": "content", "data": delta["content"]}
 
-                            if "function_call" in delta:
-                                yield {"type": "function_call", "data": delta["function_call"]}
+                            for tool_call in delta.get("tool_calls") or []:
+                                yield {"type": "tool_call", "data": tool_call}
+
+                            if chunk_data["choices"][0].get("finish_reason"):
+                                yield {"type": "finish", "data": chunk_data["choices"][0]["finish_reason"]}
                     except json.JSONDecodeError:
                         logger.error(f"Error decoding chunk: {line}")
 
+        if completion_tokens > 1 and first_delta is not None:
+            streaming_time = time.perf_counter() - first_delta
+            if streaming_time > 0:
+                COMPLETION_TOKENS_PER_SECOND.observe((completion_tokens - 1) / streaming_time)
+
 chat_service = ChatService()
\ No newline at end of file
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+# Stands in for the session folder in keys and stored entries. A NUL byte
+# never appears in encoded JSON, so the substitution cannot collide.
+SESSION_PLACEHOLDER = b"\x00session_folder\x00"
+
+def session_bytes(session_folder):
+    # The folder as it appears inside encoded JSON strings
+    return json.dumps(session_folder, ensure_ascii=False)[1:-1].encode("utf-8")
+
+class CachedResponse:
+    __slots__ = ("expires_at", "events", "messages", "size")
+
+    def __init__(self, expires_at, events, messages):
+        self.expires_at = expires_at
+        self.events = events  # encoded event list, session folder replaced
+        self.messages = messages  # [(role, data)] appended to the conversation, session folder replaced
+        self.size = len(events) + sum(len(data) for _, data in messages)
+
+    def replay(self, session_folder):
+        """(events, messages) with the placeholder replaced by this conversation's session folder."""
+        folder = session_bytes(session_folder)
+        events = json.loads(self.events.replace(SESSION_PLACEHOLDER, folder))
+        messages = [(role, data.replace(SESSION_PLACEHOLDER, folder)) for role, data in self.messages]
+        return events, messages
+
+def coalesce_content(events):
+    merged = []
+    for event in events:
+        if event["type"] == "content" and merged and merged[-1]["type"] == "content":
+            merged[-1] = {"type": "content", "content": merged[-1]["content"] + event["content"]}
+        else:
+            merged.append(event)
+    return merged
+
+class CompletionCache:
+    """Exact-match cache of whole chat responses, keyed on the model, tools payload and message history.
+
+    An entry holds the event sequence a response streamed (tool calls and
+    their results included) and the messages it appended to the
+    conversation, so a hit can replay both without calling the model or
+    any tool. The session folder is replaced by a placeholder in keys and
+    entries; otherwise no two conversations would ever share a key.
+    """
+
+    def __init__(self, ttl, max_entries, max_bytes):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> CachedResponse
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.skipped = 0
+
+    @staticmethod
+    def key(model, tools, history, session_folder):
+        folder = session_bytes(session_folder)
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        digest.update(b"\n")
+        digest.update(tools)
+        for message in history:
+            digest.update(b"\n")
+            digest.update(message.data.replace(folder, SESSION_PLACEHOLDER))
+        return digest.hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires_at < time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, events, messages, session_folder, ttl=None):
+        """Store a response; False if it was skipped for being larger than the whole cache."""
+        folder = session_bytes(session_folder)
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        entry = CachedResponse(
+            time.monotonic() + ttl,
+            json.dumps(coalesce_content(events), separators=(",", ":"), ensure_ascii=False).encode("utf-8").replace(folder, SESSION_PLACEHOLDER),
+            [(message.role, message.data.replace(folder, SESSION_PLACEHOLDER)) for message in messages],
+        )
+        if entry.size > self.max_bytes:
+            self.skip()
+            return False
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = entry
+        self.total_bytes += entry.size
+        self.stores += 1
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+        return True
+
+    def skip(self):
+        self.skipped += 1
+
+    def _remove(self, key):
+        self.total_bytes -= self.entries.pop(key).size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "stores": self.stores,
+            "skipped": self.skipped,
+        }
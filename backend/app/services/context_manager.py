@@ -0,0 +1,128 @@
+import logging
+from app.services.conversation_store import StoredMessage, encode_message
+from app.services.metrics import CONTEXT_TOKENS_SAVED
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_OVERHEAD_TOKENS = 4  # role/separators per message in the chat format
+
+class ContextManager:
+    """Selects the part of a conversation history that is sent to the model.
+
+    The leading system messages and the current turn are always kept. Large
+    tool outputs from earlier turns are replaced with a short stub, and if
+    the prompt is still over budget the oldest turns are dropped whole so
+    assistant tool_calls always stay next to their tool results.
+    """
+
+    def __init__(self, token_budget, stale_tool_tokens, model="gpt-4o-mini"):
+        self.token_budget = token_budget
+        self.stale_tool_tokens = stale_tool_tokens
+        self.model = model
+        self._encoding = None
+        self._notes = {}  # dropped message count -> the system message saying so
+        self.builds = 0
+        self.trimmed = 0
+        self.tokens_saved = 0
+
+    def _encode_len(self, text):
+        if self._encoding is None:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.encoding_for_model(self.model)
+            except Exception:
+                # tiktoken is optional; fall back to the usual ~4 bytes per token estimate
+                self._encoding = False
+        if self._encoding:
+            return len(self._encoding.encode(text))
+        return len(text.encode("utf-8")) // 4 + 1
+
+    def count(self, message):
+        """Token count for a StoredMessage, cached on the message."""
+        if message.tokens is None:
+            decoded = message.decode()
+            text = decoded.get("content") or ""
+            for tool_call in decoded.get("tool_calls") or []:
+                text += tool_call["function"]["name"] + tool_call["function"]["arguments"]
+            message.tokens = self._encode_len(text) + MESSAGE_OVERHEAD_TOKENS
+        return message.tokens
+
+    def _stub(self, message):
+        """The stand-in for a stale message, built once and cached on the message."""
+        if message.stub is None:
+            decoded = message.decode()
+            decoded["content"] = f"[Earlier {message.role} output of about {message.tokens} tokens omitted]"
+            message.stub = StoredMessage(message.role, encode_message(decoded))
+            self.count(message.stub)
+        return message.stub
+
+    def _note(self, dropped):
+        note = self._notes.get(dropped)
+        if note is None:
+            note = self._notes[dropped] = StoredMessage("system", encode_message({
+                "role": "system",
+                "content": f"{dropped} earlier messages of this conversation were omitted to fit the context window."
+            }))
+            self.count(note)
+        return note
+
+    def build(self, history):
+        """Return the list of StoredMessage to send for this request."""
+        prefix_end = 0
+        while prefix_end < len(history) and history[prefix_end].role == "system":
+            prefix_end += 1
+        prefix = history[:prefix_end]
+
+        # Split the rest into turns, each starting at a user message
+        turns = []
+        for message in history[prefix_end:]:
+            if not turns or message.role == "user":
+                turns.append([])
+            turns[-1].append(message)
+
+        self.builds += 1
+        original = sum(self.count(message) for message in history)
+        if original <= self.token_budget or len(turns) < 2:
+            return list(history)
+
+        # Compact tool outputs from every turn but the current one
+        older = []
+        for turn in turns[:-1]:
+            compacted = []
+            for message in turn:
+                if self.count(message) > self.stale_tool_tokens and message.role in ("tool", "function"):
+                    message = self._stub(message)
+                compacted.append(message)
+            older.append(compacted)
+
+        fixed = sum(self.count(message) for message in prefix) + sum(self.count(message) for message in turns[-1])
+        total = fixed + sum(self.count(message) for turn in older for message in turn)
+        dropped = 0
+        while older and total > self.token_budget:
+            turn = older.pop(0)
+            total -= sum(self.count(message) for message in turn)
+            dropped += len(turn)
+
+        selected = list(prefix)
+        if dropped:
+            note = self._note(dropped)
+            total += self.count(note)
+            selected.append(note)
+        for turn in older:
+            selected.extend(turn)
+        selected.extend(turns[-1])
+
+        saved = original - total
+        self.trimmed += 1
+        self.tokens_saved += saved
+        CONTEXT_TOKENS_SAVED.inc(saved)
+        logger.info(f"Context trimmed from {original} to {total} tokens (saved {saved}, dropped {dropped} messages)")
+        return selected
+
+    def stats(self):
+        return {
+            "token_budget": self.token_budget,
+            "builds": self.builds,
+            "trimmed": self.trimmed,
+            "tokens_saved": self.tokens_saved,
+        }
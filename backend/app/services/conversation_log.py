@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Append-only message logs shared by every worker. Each conversation is a
+# session folder plus an ordered list of (role, compact JSON bytes) entries;
+# a turn only ever writes its new entries, and create/append return the log
+# length after the write. ConversationStore keeps the local read cache in
+# front of these.
+
+class SQLiteConversationLog:
+    """Conversation log in a SQLite database in WAL mode, for workers sharing one host or volume."""
+
+    name = "sqlite"
+
+    def __init__(self, path, idle_ttl):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA busy_timeout=5000")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                session_folder TEXT NOT NULL,
+                length INTEGER NOT NULL DEFAULT 0,
+                last_access REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS conversations_last_access ON conversations (last_access);
+        """)
+
+    async def _run(self, function, *args):
+        def locked():
+            with self.lock:
+                return function(*args)
+        return await asyncio.to_thread(locked)
+
+    def _append(self, conversation_id, entries, session_folder=None):
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            if session_folder is not None:
+                self.db.execute(
+                    "INSERT INTO conversations (id, session_folder, length, last_access) VALUES (?, ?, 0, ?)",
+                    (conversation_id, session_folder, now),
+                )
+            row = self.db.execute("SELECT length FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+            if row is None:
+                raise KeyError(conversation_id)
+            self.db.executemany(
+                "INSERT INTO messages (conversation_id, seq, role, data) VALUES (?, ?, ?, ?)",
+                [(conversation_id, row[0] + offset, role, data) for offset, (role, data) in enumerate(entries)],
+            )
+            self.db.execute(
+                "UPDATE conversations SET length = length + ?, last_access = ? WHERE id = ?",
+                (len(entries), now, conversation_id),
+            )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return row[0] + len(entries)
+
+    async def create(self, conversation_id, session_folder, entries):
+        return await self._run(self._append, conversation_id, entries, session_folder)
+
+    async def append(self, conversation_id, entries):
+        return await self._run(self._append, conversation_id, entries)
+
+    def _length(self, conversation_id):
+        row = self.db.execute(
+            "SELECT length FROM conversations WHERE id = ? AND last_access > ?",
+            (conversation_id, time.time() - self.idle_ttl),
+        ).fetchone()
+        return row[0] if row else None
+
+    async def length(self, conversation_id):
+        """Number of messages logged, or None when the conversation does not exist (or has expired)."""
+        return await self._run(self._length, conversation_id)
+
+    def _read(self, conversation_id, start):
+        row = self.db.execute("SELECT session_folder FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None, []
+        self.db.execute("UPDATE conversations SET last_access = ? WHERE id = ?", (time.time(), conversation_id))
+        entries = self.db.execute(
+            "SELECT role, data FROM messages WHERE conversation_id = ? AND seq >= ? ORDER BY seq",
+            (conversation_id, start),
+        ).fetchall()
+        return row[0], [(role, bytes(data)) for role, data in entries]
+
+    async def read(self, conversation_id, start=0):
+        """(session_folder, entries from position `start` on); session_folder is None when missing."""
+        return await self._run(self._read, conversation_id, start)
+
+    def _reap(self):
+        cutoff = time.time() - self.idle_ttl
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            expired = self.db.execute(
+                "SELECT id, session_folder FROM conversations WHERE last_access <= ?", (cutoff,)
+            ).fetchall()
+            for conversation_id, _ in expired:
+                self.db.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                self.db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return expired
+
+    async def reap(self):
+        """Delete conversations idle for longer than idle_ttl and return their (id, session_folder) pairs."""
+        return await self._run(self._reap)
+
+    async def close(self):
+        await self._run(self.db.close)
+
+class RedisConversationLog:
+    """Conversation log in Redis (or any server speaking the Redis protocol), for workers on several nodes.
+
+    Each conversation is a hash with its session folder and a list of
+    entries; both keys expire after idle_ttl without access. A sorted set
+    of conversation ids by last access, and a hash of their session
+    folders, let reap() find expired conversations (whether or not the
+    server has dropped their keys yet) and hand each one to exactly one
+    worker for cleanup.
+    """
+
+    name = "redis"
+
+    def __init__(self, url, idle_ttl, prefix="conversation:", client=None):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("CONVERSATION_BACKEND=redis requires the 'redis' package") from None
+            client = redis.from_url(url)
+        self.redis = client
+        self.idle_ttl = int(idle_ttl)
+        self.prefix = prefix
+
+    def _keys(self, conversation_id):
+        return f"{self.prefix}{conversation_id}:meta", f"{self.prefix}{conversation_id}:log"
+
+    @property
+    def _idle_key(self):
+        return f"{self.prefix}idle"
+
+    @property
+    def _folders_key(self):
+        return f"{self.prefix}folders"
+
+    @staticmethod
+    def _pack(role, data):
+        return role.encode("utf-8") + b"\n" + data
+
+    @staticmethod
+    def _unpack(entry):
+        role, _, data = entry.partition(b"\n")
+        return role.decode("utf-8"), data
+
+    async def _push(self, conversation_id, entries, session_folder=None):
+        meta_key, log_key = self._keys(conversation_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if session_folder is not None:
+                pipe.hset(meta_key, "session_folder", session_folder)
+                pipe.hset(self._folders_key, conversation_id, session_folder)
+            pipe.rpush(log_key, *(self._pack(role, data) for role, data in entries))
+            pipe.expire(meta_key, self.idle_ttl)
+            pipe.expire(log_key, self.idle_ttl)
+            pipe.zadd(self._idle_key, {conversation_id: time.time()})
+            results = await pipe.execute()
+        return results[-4]  # RPUSH returns the new list length
+
+    async def create(self, conversation_id, session_folder, entries):
+        return await self._push(conversation_id, entries, session_folder)
+
+    async def append(self, conversation_id, entries):
+        meta_key, _ = self._keys(conversation_id)
+        if not await self.redis.exists(meta_key):
+            raise KeyError(conversation_id)
+        return await self._push(conversation_id, entries)
+
+    async def length(self, conversation_id):
+        meta_key, log_key = self._keys(conversation_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.exists(meta_key)
+            pipe.llen(log_key)
+            exists, length = await pipe.execute()
+        return length if exists else None
+
+    async def read(self, conversation_id, start=0):
+        meta_key, log_key = self._keys(conversation_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hget(meta_key, "session_folder")
+            pipe.lrange(log_key, start, -1)
+            pipe.expire(meta_key, self.idle_ttl)
+            pipe.expire(log_key, self.idle_ttl)
+            pipe.zadd(self._idle_key, {conversation_id: time.time()}, xx=True)
+            session_folder, entries, _, _, _ = await pipe.execute()
+        if session_folder is None:
+            return None, []
+        return session_folder.decode("utf-8"), [self._unpack(entry) for entry in entries]
+
+    async def reap(self):
+        """Delete conversations idle for longer than idle_ttl and return their (id, session_folder) pairs."""
+        from redis.exceptions import WatchError
+        cutoff = time.time() - self.idle_ttl
+        expired = []
+        for member in await self.redis.zrangebyscore(self._idle_key, "-inf", cutoff):
+            conversation_id = member.decode("utf-8")
+            meta_key, log_key = self._keys(conversation_id)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                # Any access refreshes the meta key's TTL, which aborts the transaction
+                await pipe.watch(meta_key)
+                score = await pipe.zscore(self._idle_key, conversation_id)
+                session_folder = await pipe.hget(self._folders_key, conversation_id)
+                if score is None or score > cutoff:
+                    continue
+                pipe.multi()
+                pipe.zrem(self._idle_key, conversation_id)
+                pipe.hdel(self._folders_key, conversation_id)
+                pipe.delete(meta_key, log_key)
+                try:
+                    removed, _, _ = await pipe.execute()
+                except WatchError:
+                    continue
+            # zrem is 0 when another worker reaped it first
+            if removed and session_folder is not None:
+                expired.append((conversation_id, session_folder.decode("utf-8")))
+        return expired
+
+    async def close(self):
+        await self.redis.aclose()
+
+def create_conversation_log(backend, sqlite_path, redis_url, idle_ttl):
+    """The shared log for CONVERSATION_BACKEND, or None to keep conversations in process memory."""
+    if backend == "memory":
+        return None
+    if backend == "sqlite":
+        return SQLiteConversationLog(sqlite_path, idle_ttl)
+    if backend == "redis":
+        return RedisConversationLog(redis_url, idle_ttl)
+    raise ValueError(f"Unknown conversation backend: {backend}")
@@ -0,0 +1,253 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def encode_message(message):
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def decode_message(data):
+    return json.loads(data)
+
+class StoredMessage:
+    __slots__ = ("role", "data", "tokens", "stub")
+
+    def __init__(self, role, data):
+        self.role = role
+        self.data = data  # compact JSON bytes
+        self.tokens = None  # filled in lazily by the context manager
+        self.stub = None  # likewise, the short stand-in sent once this message is stale
+
+    def decode(self):
+        return decode_message(self.data)
+
+class Conversation:
+    __slots__ = ("conversation_id", "session_folder", "messages", "size", "synced", "last_access")
+
+    def __init__(self, conversation_id, session_folder):
+        self.conversation_id = conversation_id
+        self.session_folder = session_folder
+        self.messages = []  # StoredMessage, one entry per message
+        self.size = 0
+        self.synced = 0  # leading messages known to be in the same order as in the shared log
+        self.last_access = time.monotonic()
+
+class ConversationStore:
+    """Bounded LRU store of conversations with an idle TTL.
+
+    Messages are kept as compact JSON bytes so the byte budget tracks real
+    memory use. Conversations that are streaming a response are pinned and
+    never evicted; on_evict is called with the conversation for every
+    eviction (used to remove its session folder).
+
+    With a shared `log` (see conversation_log.py) the log is the source of
+    truth and this store is only a local read cache: new messages are
+    appended to the log, a cached conversation is topped up with whatever
+    other workers appended since, and evicting it locally loses nothing.
+    Local messages whose log position is not confirmed (another worker
+    appended first) are replaced by the log's entries from that point on.
+    on_evict is then called when the log expires a conversation instead,
+    and on_release whenever a conversation leaves this worker's cache, to
+    free the per-worker state kept for it.
+    """
+
+    REAP_INTERVAL = 60.0
+
+    def __init__(self, max_entries, max_bytes, idle_ttl, on_evict=None, on_release=None, log=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self.on_release = on_release
+        self.log = log
+        self.entries = OrderedDict()
+        self.pinned = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.next_reap = time.monotonic() + self.REAP_INTERVAL
+
+    def __contains__(self, conversation_id):
+        return conversation_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def create(self, conversation_id, session_folder, messages):
+        conversation = Conversation(conversation_id, session_folder)
+        stored = [self._append(conversation, message) for message in messages]
+        if self.log is not None:
+            try:
+                conversation.synced = await self.log.create(conversation_id, session_folder, [(message.role, message.data) for message in stored])
+            except Exception:
+                self.total_bytes -= conversation.size
+                raise
+        self.entries[conversation_id] = conversation
+        # Making room for a conversation must not evict the conversation itself
+        await self._enforce_limits(keep=conversation_id)
+        return conversation
+
+    async def get(self, conversation_id):
+        await self.reap_expired()
+        conversation = self.entries.get(conversation_id)
+        if self.log is not None:
+            conversation = await self._sync_from_log(conversation_id, conversation)
+        if conversation is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        conversation.last_access = time.monotonic()
+        self.entries.move_to_end(conversation_id)
+        return conversation
+
+    async def _sync_from_log(self, conversation_id, conversation):
+        length = await self.log.length(conversation_id)
+        if length is None:
+            if conversation is not None:
+                # Expired in the shared log; the cached copy must not outlive it
+                self.entries.pop(conversation_id)
+                self.total_bytes -= conversation.size
+                self._notify(self.on_release, conversation)
+            return None
+        if conversation is not None and length == conversation.synced == len(conversation.messages):
+            return conversation
+
+        start = conversation.synced if conversation is not None else 0
+        session_folder, entries = await self.log.read(conversation_id, start)
+        if session_folder is None:
+            return None
+        if conversation is None:
+            conversation = Conversation(conversation_id, session_folder)
+            self.entries[conversation_id] = conversation
+            self.loads += 1
+        else:
+            self.refreshes += 1
+            self._truncate(conversation, start)
+        for role, data in entries:
+            self._add(conversation, StoredMessage(role, data))
+        conversation.synced = start + len(entries)
+        await self._enforce_limits()
+        return conversation
+
+    def _truncate(self, conversation, length):
+        removed = sum(len(message.data) for message in conversation.messages[length:])
+        del conversation.messages[length:]
+        conversation.size -= removed
+        self.total_bytes -= removed
+
+    async def append(self, conversation_id, *messages):
+        conversation = self.entries.get(conversation_id)
+        if conversation is None:
+            logger.warning(f"Dropping message for evicted conversation {conversation_id}")
+            return
+        position = len(conversation.messages)
+        stored = [self._append(conversation, message) for message in messages]
+        if self.log is not None:
+            # Only the new messages are written; earlier ones are never rewritten
+            length = await self.log.append(conversation_id, [(message.role, message.data) for message in stored])
+            # They are in log order only if nothing else was appended in between, here or by another worker
+            if length - len(stored) == position == conversation.synced and len(conversation.messages) >= length and all(
+                local is message for local, message in zip(conversation.messages[position:], stored)
+            ):
+                conversation.synced = length
+        await self._enforce_limits()
+
+    def _append(self, conversation, message):
+        # Pre-encoded messages (e.g. the shared system prompts) are stored as they are
+        if not isinstance(message, StoredMessage):
+            message = StoredMessage(message["role"], encode_message(message))
+        return self._add(conversation, message)
+
+    def _add(self, conversation, stored):
+        conversation.messages.append(stored)
+        conversation.size += len(stored.data)
+        self.total_bytes += len(stored.data)
+        conversation.last_access = time.monotonic()
+        return stored
+
+    def pin(self, conversation_id):
+        self.pinned[conversation_id] = self.pinned.get(conversation_id, 0) + 1
+
+    def unpin(self, conversation_id):
+        count = self.pinned.get(conversation_id, 0) - 1
+        if count > 0:
+            self.pinned[conversation_id] = count
+        else:
+            self.pinned.pop(conversation_id, None)
+
+    async def reap_expired(self):
+        if self.log is not None:
+            await self._reap_log()
+        cutoff = time.monotonic() - self.idle_ttl
+        # Entries are in access order, so expired ones are at the front
+        for conversation_id, conversation in list(self.entries.items()):
+            if conversation.last_access > cutoff:
+                break
+            if conversation_id in self.pinned:
+                continue
+            self._evict(conversation_id)
+            self.expirations += 1
+
+    async def _reap_log(self):
+        now = time.monotonic()
+        if now < self.next_reap:
+            return
+        self.next_reap = now + self.REAP_INTERVAL
+        for conversation_id, session_folder in await self.log.reap():
+            self.expirations += 1
+            conversation = self.entries.pop(conversation_id, None)
+            if conversation is not None:
+                self.total_bytes -= conversation.size
+            self._notify(self.on_evict, conversation or Conversation(conversation_id, session_folder))
+
+    async def _enforce_limits(self, keep=None):
+        await self.reap_expired()
+        for conversation_id in list(self.entries):
+            if len(self.entries) <= self.max_entries and self.total_bytes <= self.max_bytes:
+                break
+            if conversation_id in self.pinned or conversation_id == keep:
+                continue
+            self._evict(conversation_id)
+            self.evictions += 1
+
+    def _evict(self, conversation_id):
+        conversation = self.entries.pop(conversation_id)
+        self.total_bytes -= conversation.size
+        logger.info(f"Evicted conversation {conversation_id} ({conversation.size} bytes)")
+        # Without a log this copy was the only one; otherwise the log decides when it is gone
+        self._notify(self.on_evict if self.log is None else self.on_release, conversation)
+
+    @staticmethod
+    def _notify(callback, conversation):
+        if callback is not None:
+            try:
+                callback(conversation)
+            except Exception as e:
+                logger.error(f"Error cleaning up conversation {conversation.conversation_id}: {str(e)}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.log.name if self.log is not None else "memory",
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    async def close(self):
+        if self.log is not None:
+            await self.log.close()
@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from app.services.prefetcher import file_identity
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_EXTENSIONS = ('.pdf', '.docx', '.txt')
+# Bump when extract_passages changes so stale cached text is not reused
+EXTRACTION_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were with".split()
+)
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+def estimate_tokens(text):
+    return len(text.encode("utf-8")) // 4 + 1
+
+def hash_file(path, chunk_size=1024 * 1024):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+class TextCache:
+    """Extracted passages on disk, keyed by the sha256 of the file they came from and shared by every session."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], f"{sha256}.v{EXTRACTION_VERSION}.json")
+
+    def get(self, sha256):
+        try:
+            with open(self.path(sha256), "r", encoding="utf-8") as f:
+                return [tuple(passage) for passage in json.load(f)]
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, sha256, passages):
+        path = self.path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(passages, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+class SessionIndex:
+    """BM25 inverted index over the passages of one session's documents, updated a file at a time."""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.passages = {}  # passage id -> (file name, location, text, length in terms)
+        self.postings = defaultdict(dict)  # term -> {passage id: term frequency}
+        self.files = {}  # file name -> (identity, sha256, [passage ids])
+        self.total_length = 0
+        self.next_id = 0
+
+    def is_current(self, name, identity):
+        entry = self.files.get(name)
+        return entry is not None and entry[0] == identity
+
+    def add(self, name, identity, sha256, passages):
+        if name in self.files:
+            if self.files[name][1] == sha256:
+                self.files[name] = (identity, sha256, self.files[name][2])
+                return
+            self.remove(name)
+        ids = []
+        for location, text in passages:
+            terms = Counter(tokenize(text))
+            passage_id = self.next_id
+            self.next_id += 1
+            length = sum(terms.values())
+            self.passages[passage_id] = (name, location, text, length)
+            self.total_length += length
+            for term, count in terms.items():
+                self.postings[term][passage_id] = count
+            ids.append(passage_id)
+        self.files[name] = (identity, sha256, ids)
+
+    def remove(self, name):
+        _, _, ids = self.files.pop(name)
+        for passage_id in ids:
+            _, _, text, length = self.passages.pop(passage_id)
+            self.total_length -= length
+            for term in set(tokenize(text)):
+                postings = self.postings[term]
+                postings.pop(passage_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def search(self, query, top_k):
+        """[(score, file name, location, text)] for the best-scoring passages, best first."""
+        if not self.passages:
+            return []
+        count = len(self.passages)
+        average_length = self.total_length / count or 1
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for passage_id, frequency in postings.items():
+                length = self.passages[passage_id][3]
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[passage_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(score, *self.passages[passage_id][:3]) for passage_id, score in best]
+
+class DocumentIndex:
+    """Full-text search over the PDF, DOCX and TXT files in each session folder.
+
+    Files are indexed as they arrive (see schedule) or, at the latest, when
+    a session is searched. Text is extracted in the worker pool at most once
+    per file content: the passages are cached on disk by sha256, so the same
+    record downloaded into many sessions, or by another worker, is parsed
+    once. A file is re-indexed only when its inode, size or mtime changes.
+    """
+
+    def __init__(self, cache_dir, extract):
+        self.cache = TextCache(cache_dir)
+        self.extract = extract  # async (full_path) -> [(location, text)]
+        self.sessions = {}  # session folder -> SessionIndex
+        self.tasks = {}  # (session folder, file name) -> indexing task
+        self.extracted = 0
+        self.cache_hits = 0
+        self.searches = 0
+        self.failures = 0
+
+    def schedule(self, session_folder, full_path):
+        """Start indexing a file in the background if it is a searchable document."""
+        if full_path.lower().endswith(DOCUMENT_EXTENSIONS):
+            self._task(session_folder, os.path.basename(full_path))
+
+    def _task(self, session_folder, name):
+        key = (session_folder, name)
+        task = self.tasks.get(key)
+        if task is None:
+            task = self.tasks[key] = asyncio.ensure_future(self._index(session_folder, name))
+            task.add_done_callback(lambda _: self.tasks.pop(key, None))
+        return task
+
+    async def _index(self, session_folder, name):
+        full_path = os.path.join(session_folder, name)
+        try:
+            identity = file_identity(full_path)
+            index = self.sessions.setdefault(session_folder, SessionIndex())
+            if index.is_current(name, identity):
+                return
+            sha256 = await asyncio.to_thread(hash_file, full_path)
+            passages = await asyncio.to_thread(self.cache.get, sha256)
+            if passages is None:
+                passages = await self.extract(full_path)
+                await asyncio.to_thread(self.cache.put, sha256, passages)
+                self.extracted += 1
+            else:
+                self.cache_hits += 1
+            if session_folder in self.sessions:
+                index.add(name, identity, sha256, passages)
+                logger.info(f"Indexed {name} ({len(passages)} passages) for {session_folder}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Error indexing {full_path}: {str(e)}")
+
+    async def refresh(self, session_folder):
+        """Bring a session's index up to date with the files currently in its folder."""
+        try:
+            names = {
+                entry.name for entry in os.scandir(session_folder)
+                if entry.is_file() and entry.name.lower().endswith(DOCUMENT_EXTENSIONS)
+            }
+        except FileNotFoundError:
+            names = set()
+        index = self.sessions.setdefault(session_folder, SessionIndex())
+        for name in set(index.files) - names:
+            index.remove(name)
+        tasks = [self._task(session_folder, name) for name in names]
+        if tasks:
+            await asyncio.gather(*(asyncio.shield(task) for task in tasks))
+        return index
+
+    async def search(self, session_folder, query, top_k=5, token_budget=1500):
+        """Up to top_k (score, file name, location, text) passages whose combined text fits token_budget."""
+        index = await self.refresh(session_folder)
+        self.searches += 1
+        results = []
+        remaining = token_budget
+        for score, name, location, text in index.search(query, top_k):
+            tokens = estimate_tokens(text)
+            if tokens > remaining:
+                if results:
+                    break
+                # Always return something: cut the best passage down to the budget
+                text = text[:remaining * 4]
+                tokens = remaining
+            results.append((score, name, location, text))
+            remaining -= tokens
+        return results
+
+    def discard(self, session_folder):
+        self.sessions.pop(session_folder, None)
+        for (folder, _), task in list(self.tasks.items()):
+            if folder == session_folder:
+                task.cancel()
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "files": sum(len(index.files) for index in self.sessions.values()),
+            "passages": sum(len(index.passages) for index in self.sessions.values()),
+            "indexing": len(self.tasks),
+            "extracted": self.extracted,
+            "text_cache_hits": self.cache_hits,
+            "searches": self.searches,
+            "failures": self.failures,
+        }
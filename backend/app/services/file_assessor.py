@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from xml.etree import ElementTree
+from app.services.metrics import ASSESSMENT_JOBS
+
+logger = logging.getLogger(__name__)
+
+TEXT_CHUNK_SIZE = 1024 * 1024
+PASSAGE_WORDS = 150  # target size of the passages extract_passages returns
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# The Pixtral library lives next to backend/ in the repository
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# The assess_* functions below run inside the worker pool, so they only use
+# module-level state and import their heavy dependencies themselves.
+
+def assess_path(full_path):
+    file_size = os.path.getsize(full_path)
+    file_ext = os.path.splitext(full_path)[1].lower()
+
+    assessment = f"File: {os.path.basename(full_path)}\n"
+    assessment += f"File size: {file_size} bytes\n"
+    assessment += f"File type: {file_ext}\n\n"
+
+    if file_ext == '.pdf':
+        assessment += assess_pdf(full_path)
+    elif file_ext == '.docx':
+        assessment += assess_docx(full_path)
+    elif file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
+        assessment += assess_image(full_path)
+    elif file_ext == '.txt':
+        assessment += assess_text(full_path)
+    else:
+        assessment += f"This file has an unrecognized file type: {file_ext}\n"
+    return assessment
+
+def assess_pdf(full_path):
+    import fitz  # PyMuPDF
+    try:
+        with fitz.open(full_path) as doc:
+            assessment = f"PDF file with {len(doc)} pages.\n"
+            toc = doc.get_toc()
+            if toc:
+                assessment += "Table of Contents:\n"
+                for item in toc[:5]:  # Show first 5 ToC items
+                    assessment += f"- {' '.join(map(str, item))}\n"
+                if len(toc) > 5:
+                    assessment += f"... and {len(toc) - 5} more items\n"
+            return assessment
+    except Exception as e:
+        return f"Unable to analyze PDF structure: {str(e)}\n"
+
+def assess_image(full_path):
+    from PIL import Image
+    try:
+        with Image.open(full_path) as img:
+            return f"Image file. Dimensions: {img.size[0]}x{img.size[1]} pixels. Mode: {img.mode}.\n"
+    except Exception as e:
+        return f"Unable to analyze image: {str(e)}\n"
+
+def assess_text(full_path):
+    # Count in fixed-size chunks so memory use does not depend on file size
+    line_count = 1
+    word_count = 0
+    head = b""
+    previous_ended_in_word = False
+    with open(full_path, 'rb') as text_file:
+        for chunk in iter(lambda: text_file.read(TEXT_CHUNK_SIZE), b""):
+            if len(head) < 400:
+                head += chunk[:400]
+            line_count += chunk.count(b'\n')
+            word_count += len(chunk.split())
+            # A word split across the chunk boundary was counted twice
+            if previous_ended_in_word and not chunk[:1].isspace():
+                word_count -= 1
+            previous_ended_in_word = not chunk[-1:].isspace()
+    preview = head.decode('utf-8', errors='ignore')[:100]
+    assessment = f"Text file containing approximately {line_count} lines and {word_count} words.\n"
+    assessment += f"First 100 characters: {preview}...\n"
+    return assessment
+
+def paragraph_text(paragraph):
+    parts = []
+    for node in paragraph.iter():
+        if node.tag == f"{WORD_NS}t":
+            parts.append(node.text or "")
+        elif node.tag in (f"{WORD_NS}br", f"{WORD_NS}tab", f"{WORD_NS}cr"):
+            parts.append(" ")
+    return "".join(parts)
+
+def assess_docx(full_path):
+    try:
+        with zipfile.ZipFile(full_path) as archive:
+            paragraphs = 0
+            tables = 0
+            images = 0
+            words = 0
+            headings = []
+            text_preview = ""
+            with archive.open("word/document.xml") as document:
+                for _, element in ElementTree.iterparse(document, events=("end",)):
+                    if element.tag == f"{WORD_NS}p":
+                        paragraphs += 1
+                        text = paragraph_text(element)
+                        words += len(text.split())
+                        if len(text_preview) < 100:
+                            text_preview += text + " "
+                        style = element.find(f"{WORD_NS}pPr/{WORD_NS}pStyle")
+                        style_name = style.get(f"{WORD_NS}val", "") if style is not None else ""
+                        if text.strip() and (style_name.startswith("Heading") or style_name == "Title"):
+                            headings.append((style_name, text.strip()))
+                        element.clear()
+                    elif element.tag == f"{WORD_NS}tbl":
+                        tables += 1
+                    elif element.tag == f"{WORD_NS}drawing":
+                        images += 1
+            pages = None
+            if "docProps/app.xml" in archive.namelist():
+                app_props = ElementTree.fromstring(archive.read("docProps/app.xml"))
+                pages_element = next((node for node in app_props if node.tag.endswith("}Pages")), None)
+                if pages_element is not None:
+                    pages = pages_element.text
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        return f"Unable to analyze DOCX structure: {str(e)}\n"
+
+    assessment = f"DOCX file with {paragraphs} paragraphs, {words} words, {tables} tables and {images} images"
+    assessment += f" ({pages} pages as last saved).\n" if pages else ".\n"
+    if headings:
+        assessment += "Headings:\n"
+        for style_name, text in headings[:5]:  # Show first 5 headings
+            assessment += f"- {text} ({style_name})\n"
+        if len(headings) > 5:
+            assessment += f"... and {len(headings) - 5} more headings\n"
+    assessment += f"First 100 characters: {text_preview.strip()[:100]}...\n"
+    return assessment
+
+def pack_passages(sections):
+    """Merge (location, text) sections into passages of about PASSAGE_WORDS words.
+
+    A passage is labelled with the location of its first section, plus the
+    last one when it spans several; sections longer than a passage are split.
+    """
+    passages = []
+    words = []
+    first = last = None
+
+    def flush():
+        if words:
+            passages.append((first if first == last else f"{first}-{last.split()[-1]}", " ".join(words)))
+
+    for location, text in sections:
+        section_words = text.split()
+        while section_words:
+            if not words:
+                first = location
+            last = location
+            room = PASSAGE_WORDS - len(words)
+            words.extend(section_words[:room])
+            section_words = section_words[room:]
+            if len(words) >= PASSAGE_WORDS:
+                flush()
+                words = []
+    flush()
+    return passages
+
+def pdf_sections(full_path):
+    import fitz  # PyMuPDF
+    with fitz.open(full_path) as doc:
+        for number, page in enumerate(doc, 1):
+            yield f"page {number}", page.get_text()
+
+def docx_sections(full_path):
+    with zipfile.ZipFile(full_path) as archive:
+        with archive.open("word/document.xml") as document:
+            number = 0
+            for _, element in ElementTree.iterparse(document, events=("end",)):
+                if element.tag == f"{WORD_NS}p":
+                    number += 1
+                    yield f"paragraph {number}", paragraph_text(element)
+                    element.clear()
+
+def text_sections(full_path):
+    with open(full_path, 'r', encoding='utf-8', errors='ignore') as text_file:
+        for number, line in enumerate(text_file, 1):
+            yield f"line {number}", line
+
+DOCUMENT_SECTIONS = {
+    '.pdf': pdf_sections,
+    '.docx': docx_sections,
+    '.txt': text_sections,
+}
+
+def extract_passages(full_path):
+    """The text of a PDF, DOCX or TXT file as [(location, passage)], e.g. ("page 3", "...")."""
+    sections = DOCUMENT_SECTIONS[os.path.splitext(full_path)[1].lower()]
+    return pack_passages(sections(full_path))
+
+def load_pixtral():
+    try:
+        import pixtral_function
+    except ImportError:
+        if REPO_ROOT in sys.path:
+            raise
+        sys.path.append(REPO_ROOT)
+        import pixtral_function
+    return pixtral_function
+
+def render_pdf_page(*args):
+    """Pixtral's render_page, importable by pool workers started before pixtral_function was on sys.path."""
+    return load_pixtral().mistral_example.render_page(*args)
+
+class PoolFullError(Exception):
+    pass
+
+class AssessmentPool:
+    """Bounded worker pool that keeps file parsing off the event loop.
+
+    At most `workers` jobs are handed to the executor at a time; further
+    jobs wait in a queue of at most `max_queue` entries and are rejected
+    beyond that. A job that exceeds `timeout` is reported as timed out, but
+    its worker slot is only released once the job actually finishes.
+    """
+
+    def __init__(self, kind="process", workers=2, max_queue=32, timeout=20.0):
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(workers)
+        self.executor = None
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def _executor(self):
+        if self.executor is None:
+            if self.kind == "process":
+                # Forking a process that already runs threads (the event loop's executors,
+                # the logging listener) can leave locks held in the child
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="assess")
+        return self.executor
+
+    def _release(self, future):
+        if not future.cancelled():
+            future.exception()  # mark as retrieved when the caller already timed out
+        self.running -= 1
+        ASSESSMENT_JOBS.dec(state="running")
+        self.completed += 1
+        self.slots.release()
+
+    async def run(self, func, *args):
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise PoolFullError(f"File assessment queue is full ({self.max_queue} waiting)")
+        self.queued += 1
+        ASSESSMENT_JOBS.inc(state="queued")
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+            ASSESSMENT_JOBS.dec(state="queued")
+        self.running += 1
+        ASSESSMENT_JOBS.inc(state="running")
+        future = asyncio.get_running_loop().run_in_executor(self._executor(), func, *args)
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    async def assess(self, full_path):
+        return await self.run(assess_path, full_path)
+
+    async def extract(self, full_path):
+        return await self.run(extract_passages, full_path)
+
+    def page_renderer(self):
+        """A render callable for pixtral's extract_images_from_pdf that queues pages in this pool.
+
+        It is called from the thread that iterates over the pages, so jobs
+        are handed back to the event loop the pool belongs to.
+        """
+        loop = asyncio.get_running_loop()
+
+        def render(*args):
+            return asyncio.run_coroutine_threadsafe(self.run(render_pdf_page, *args), loop)
+
+        render.workers = self.workers  # keep only as many pages in flight as the pool can work on
+        return render
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "queue_depth": self.queued,
+            "running": self.running,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+        }
@@ -1,124 +1,233 @@
 from datetime import datetime
+import asyncio
 import random
 import httpx
 from app.core.config import settings
+from app.services.blob_store import BlobStore
+from app.services.document_index import DocumentIndex
+from app.services.file_assessor import AssessmentPool, PoolFullError, load_pixtral
+from app.services.prefetcher import RecordPrefetcher
+from app.services.tool_cache import ToolResultCache, normalise_arguments
+from app.services.tool_output import compact_output, output_size, read_json_items
+from app.services.tool_registry import tool, tool_registry
+import importlib
 import json
+import logging
+import math
 import os
-from PIL import Image
-import fitz  # PyMuPDF
+import time
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+# Imported on first use by the tools that need them (see FunctionHandler.prewarm)
+HEAVY_MODULES = ("fitz", "PIL.Image")
+
+def record_file_name(file_type):
+    return f"medical_record.{file_type}"
+
+def resolve_session_path(session_folder, file_path):
+    """file_path joined to session_folder, or None if it resolves (through .., or symlinks) outside it."""
+    full_path = os.path.normpath(os.path.join(session_folder, file_path))
+    root = os.path.realpath(session_folder)
+    if os.path.commonpath([root, os.path.realpath(full_path)]) != root:
+        return None
+    return full_path
 
 class FunctionHandler:
-    def __init__(self):
-        self.functions = {
-            "get_current_time": {
-                "function": self.get_current_time,
-                "description": "Get the current date and time",
-                "parameters": {
-                    "type": "object",
-                    "properties": {},
-                    "required": []
-                }
-            },
-            "get_random_number": {
-                "function": self.get_random_number,
-                "description": "Get a random number between a minimum and maximum value",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "min": {"type": "number", "description": "The minimum value"},
-                        "max": {"type": "number", "description": "The maximum value"}
-                    },
-                    "required": ["min", "max"]
-                }
-            },
-            "brave_search": {
-                "function": self.brave_search,
-                "description": "Perform a web search for recent information",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "The search query"}
-                    },
-                    "required": ["query"]
-                }
-            },
-            "fetch_portfolio_performance": {
-                "function": self.call_endpoint,
-                "description": "Call portfolio performance (time series) and process the response",
-                "parameters": {
-                    "type": "object",
-                    "properties": {},
-                    "required": []
-                }
-            },
-            "query_medical_records": {
-                "function": self.query_medical_records,
-                "description": "Query the server for the filenames of available medical records - only query once",
-                "parameters": {
-                    "type": "object",
-                    "properties": {},
-                    "required": []
-                }
-            },
-            "download_medical_record": {
-                "function": self.download_medical_record,
-                "description": "Download a specific medical record from the server",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "file_type": {"type": "string", "description": "The type of file to download (docx, pdf, image, or txt)"},
-                        "session_folder": {"type": "string", "description": "The path to the session folder"}
-                    },
-                    "required": ["file_type", "session_folder"]
-                }
-            },
-            "assess_file": {
-                "function": self.assess_file,
-                "description": "Assess the content of a file and provide a summary of its properties and contents",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "file_path": {"type": "string", "description": "The path to the file to be assessed"},
-                        "session_folder": {"type": "string", "description": "The path to the session folder"}
-                    },
-                    "required": ["file_path", "session_folder"]
-                }
-            }
-        }
+    def __init__(self, http_pool=None, registry=tool_registry):
+        self.http_pool = http_pool  # HTTPClientPool, injected by the app lifespan
+        self.registry = registry
+        # Per-tool concurrency limits and result caches, created on a tool's first call
+        self.semaphores = {}
+        self.caches = {}
+        self._blob_store = None
+        self._assessment_pool = None
+        self._prefetcher = None
+        self._documents = None
+
+    @property
+    def blob_store(self):
+        if self._blob_store is None:
+            self._blob_store = BlobStore(
+                settings.BLOB_STORE_DIR,
+                chunk_size=settings.DOWNLOAD_CHUNK_SIZE,
+                max_bytes=settings.BLOB_STORE_MAX_BYTES,
+                ttl=settings.BLOB_STORE_TTL,
+            )
+        return self._blob_store
+
+    @property
+    def assessment_pool(self):
+        if self._assessment_pool is None:
+            self._assessment_pool = AssessmentPool(
+                kind=settings.ASSESS_POOL_KIND,
+                workers=settings.ASSESS_POOL_WORKERS,
+                max_queue=settings.ASSESS_POOL_MAX_QUEUE,
+                timeout=settings.ASSESS_FILE_TIMEOUT,
+            )
+        return self._assessment_pool
+
+    @property
+    def prefetcher(self):
+        if self._prefetcher is None:
+            self._prefetcher = RecordPrefetcher(
+                download=self.fetch_record,
+                assess=self.assessment_pool.assess,
+                max_concurrency=settings.PREFETCH_MAX_CONCURRENCY,
+                bytes_per_second=settings.PREFETCH_MAX_BYTES_PER_SECOND,
+            )
+        return self._prefetcher
 
-    def get_function_descriptions(self):
-        return [
-            {
-                "name": name,
-                "description": info["description"],
-                "parameters": info["parameters"]
-            }
-            for name, info in self.functions.items()
+    @property
+    def documents(self):
+        if self._documents is None:
+            self._documents = DocumentIndex(settings.DOCUMENT_TEXT_CACHE_DIR, extract=self.assessment_pool.extract)
+        return self._documents
+
+    async def fetch_record(self, url, file_path, throttle=None):
+        result = await self.blob_store.fetch(self.http_pool.get("records"), url, file_path, throttle=throttle)
+        # Index it for search_session_documents while the model decides what to do next
+        self.documents.schedule(os.path.dirname(file_path), file_path)
+        return result
+
+    def prefetch_records(self, session_folder, manifest):
+        """Start downloading and assessing every file in a query_medical_records result."""
+        if not settings.PREFETCH_ENABLED:
+            return 0
+        try:
+            urls = json.loads(manifest).values()
+        except (ValueError, AttributeError):
+            return 0
+        jobs = [
+            (url, os.path.join(session_folder, record_file_name(url.rsplit("/", 1)[1])))
+            for url in urls
+            if isinstance(url, str) and url.startswith("/download/")
         ]
+        return self.prefetcher.start(session_folder, jobs)
+
+    def shutdown(self):
+        if self._assessment_pool is not None:
+            self._assessment_pool.shutdown()
+
+    def get_tools_payload_bytes(self):
+        return self.registry.payload_bytes()
+
+    def _runtime(self, tool):
+        semaphore = self.semaphores.get(tool.name)
+        if semaphore is None:
+            semaphore = self.semaphores[tool.name] = asyncio.Semaphore(
+                tool.options.get("max_concurrency", settings.TOOL_MAX_CONCURRENCY)
+            )
+        options = tool.options.get("cache", {})
+        # "cache": False opts a tool out of result caching
+        if options is not False and tool.name not in self.caches:
+            self.caches[tool.name] = ToolResultCache(
+                ttl=options.get("ttl", settings.TOOL_CACHE_TTL),
+                max_entries=options.get("max_entries", settings.TOOL_CACHE_MAX_ENTRIES),
+            )
+        return semaphore, self.caches.get(tool.name)
 
     async def call_function(self, function_name, *args, **kwargs):
-        if function_name in self.functions:
-            func = self.functions[function_name]["function"]
-            # Remove 'session_folder' from kwargs if the function doesn't expect it
-            if 'session_folder' in kwargs and 'session_folder' not in func.__code__.co_varnames:
-                del kwargs['session_folder']
-            result = await func(**kwargs)
-            return str(result)  # Convert all results to strings
+        tool = self.registry.get(function_name)
+        session_folder = kwargs.get("session_folder")
+        kwargs = tool.validate(kwargs)
+        func = tool.bind(self)
+        timeout = tool.options.get("timeout", settings.TOOL_TIMEOUT)
+        semaphore, cache = self._runtime(tool)
+
+        async def invoke():
+            async with semaphore:
+                result = await asyncio.wait_for(func(**kwargs), timeout=timeout)
+            return self.compact_output(tool, result)
+
+        if cache is None:
+            result = await invoke()
         else:
-            raise ValueError(f"Unknown function: {function_name}")
+            result = await cache.get_or_call(normalise_arguments(kwargs), invoke, cacheable=self.is_cacheable)
+        on_result = tool.options.get("on_result")
+        if on_result is not None:
+            try:
+                on_result(self, session_folder, result)
+            except Exception as e:
+                logger.error(f"on_result hook of {tool.name} failed: {str(e)}")
+        return result
+
+    @staticmethod
+    def compact_output(tool, result):
+        """Project, compact and size-limit a tool's return value into the string sent to the model."""
+        spec = tool.options.get("output", {})
+        if "max_tokens" in spec:
+            max_bytes = spec["max_tokens"] * 4  # the usual ~4 bytes per token
+        else:
+            max_bytes = spec.get("max_bytes", settings.TOOL_OUTPUT_MAX_BYTES)
+        output = compact_output(result, spec, max_bytes)
+        before = output_size(result)
+        after = len(output.encode("utf-8"))
+        logger.info(f"Output of {tool.name}: {before} bytes, {after} bytes after compaction")
+        return output
+
+    def replay_ttl(self, function_name):
+        """How long a whole chat response that called this tool may be replayed, or None if never.
+
+        Time-sensitive tools and tools without result caching (side effects,
+        random or per-session output) are never replayed; otherwise a replay
+        may not outlive the tool's own cached result.
+        """
+        try:
+            tool = self.registry.get(function_name)
+        except ValueError:
+            return None
+        options = tool.options.get("cache", {})
+        if tool.options.get("time_sensitive") or options is False:
+            return None
+        return options.get("ttl", settings.TOOL_CACHE_TTL)
 
+    @staticmethod
+    def is_cacheable(result):
+        # Tools report upstream failures as strings rather than raising
+        return not result.startswith(("Error:", "An error occurred"))
+
+    def cache_stats(self):
+        return {name: cache.stats() for name, cache in self.caches.items()}
+
+    @staticmethod
+    def prewarm():
+        """Import the heavy optional dependencies ahead of the first tool call."""
+        for module in HEAVY_MODULES:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(module)
+                logger.info(f"Pre-warmed {module} in {(time.perf_counter() - start) * 1000:.1f} ms")
+            except ImportError as e:
+                logger.warning(f"Could not pre-warm {module}: {str(e)}")
+
+    @tool("Get the current date and time", cache=False, time_sensitive=True)
     @staticmethod
     async def get_current_time():
         return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+    @tool(
+        "Get a random number between a minimum and maximum value",
+        params={"min": "The minimum value", "max": "The maximum value"},
+        cache=False,
+    )
     @staticmethod
-    async def get_random_number(min: int, max: int):
-        return random.randint(min, max)
+    async def get_random_number(min: float, max: float):
+        # The schema advertises "number", so models may send 1.0; randint needs ints
+        return random.randint(math.ceil(min), math.floor(max))
 
-    @staticmethod
-    async def brave_search(query: str):
-        print("Performing Brave Search")
-        base_url = "https://api.search.brave.com/res/v1/web/search"
+    @tool(
+        "Perform a web search for recent information",
+        params={"query": "The search query"},
+        cache={"ttl": 600},
+        max_concurrency=4,
+        timeout=10.0,
+        time_sensitive=True,
+        output={"fields": {"title": "title", "url": "url", "snippet": "description"}, "strip_html": True},
+    )
+    async def brave_search(self, query: str):
+        logger.info("Performing Brave Search")
         headers = {
             "Accept": "application/json",
             "Accept-Encoding": "gzip",
@@ -128,126 +237,180 @@ class FunctionHandler:
             "q": query
         }
 
-        async with httpx.AsyncClient() as client:
-            try:
-                print("Sending request to Brave Search API")
-                response = await client.get(base_url, headers=headers, params=params)
+        client = self.http_pool.get("brave")
+        try:
+            logger.info("Sending request to Brave Search API")
+            async with client.stream("GET", "/web/search", headers=headers, params=params) as response:
+                if response.is_error:
+                    await response.aread()
                 response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as e:
-                return f"Error: {e.response.status_code} - {e.response.text}"
-            except Exception as e:
-                return f"An error occurred: {str(e)}"
+                # Only the top results are kept, so stop reading once they have arrived
+                return await read_json_items(response, "web.results", settings.BRAVE_MAX_RESULTS)
+        except httpx.HTTPStatusError as e:
+            return f"Error: {e.response.status_code} - {e.response.text}"
+        except Exception as e:
+            return f"An error occurred: {str(e)}"
 
-    @staticmethod
-    async def call_endpoint():
+    @tool(
+        "Call portfolio performance (time series) and process the response",
+        name="fetch_portfolio_performance",
+        cache={"ttl": 60},
+        max_concurrency=2,
+        timeout=15.0,
+    )
+    async def call_endpoint(self):
         headers = {
             "Authorization": f"Bearer eyJraWQiOiJEVHVvM0VOYVZhdldxNk4rVitPV2dvU1Q0Q0tJYlhsTmErb2E4WDhWZTZnPSIsImFsZyI6IlJTMjU2In0.eyJzdWIiOiI2YzI0NzBjNy02Y2E2LTQzYzktYmYzYS0xNThiZDc0ODAxZDEiLCJjb2duaXRvOmdyb3VwcyI6WyJtYW5hZ2VyIl0sImlzcyI6Imh0dHBzOlwvXC9jb2duaXRvLWlkcC5ldS13ZXN0LTIuYW1hem9uYXdzLmNvbVwvZXUtd2VzdC0yX1VNenlka3RjTCIsImNsaWVudF9pZCI6IjcwZnM5czRqNDhtcnB2bmZrMWZ1YmYxYjZrIiwiZXZlbnRfaWQiOiI4MTliNWEyZC0yZGRmLTQyN2QtYTgyMC03ODg5NDcyNGYwNGYiLCJ0b2tlbl91c2UiOiJhY2Nlc3MiLCJzY29wZSI6ImF3cy5jb2duaXRvLnNpZ25pbi51c2VyLmFkbWluIiwiYXV0aF90aW1lIjoxNzI3NDYxMDgyLCJleHAiOjE3MjgyMTA5NTIsImlhdCI6MTcyODIwNzM1MiwianRpIjoiZDRjOTIyY2ItZWM0My00NTQyLWFjYmUtMzNkYjczMWFlMGNiIiwidXNlcm5hbWUiOiI2YzI0NzBjNy02Y2E2LTQzYzktYmYzYS0xNThiZDc0ODAxZDEifQ.EeBekVbG-5L6Hor09drs2nDv8EYpg7qse7qm8Oa8WhKsZXV5ZR7VoObqbbQue0TPV7grQ_mGtDTTF4HOTa9QSmROUyn_H_cFtGsDjXym7kwthYhyS14qipbaVdUNaEWWyNkHBLUQ23ObSmMhAnAZsKWVtbnZHYMvwl5lbW_3VuQp7b1i7rC9C0JlhfNVmN32Hjs3HKyi3WrMnV-xMwkI4Lq74PVdXfsYBF_B57MWntRaNGLgCalRTF35bYEPOmhxHZ33IXF1eB--jNVtcP_9dS_hbEIXCQr4pnFG5dk42D0HnOexybFpcD_SBe5YcGocE-RwDdwYgqXs2zfjuVOClA",
             "Accept": "*/*"
         }
 
-        async with httpx.AsyncClient() as client:
-            try:
-                url = 'https://stage.illio.com/api/v3/portfolio/9dfc1c38-d96c-4b4b-8e85-7be8ef27fcd0/insight/summary'
-                response = await client.get(url, headers=headers)
-                response.raise_for_status()
+        client = self.http_pool.get("portfolio")
+        try:
+            url = '/portfolio/9dfc1c38-d96c-4b4b-8e85-7be8ef27fcd0/insight/summary'
+            response = await client.get(url, headers=headers)
+            response.raise_for_status()
 
-                content_type = response.headers.get("Content-Type", "")
+            content_type = response.headers.get("Content-Type", "")
 
-                if "application/json" in content_type:
-                    return json.dumps(response.json(), indent=2)
-                elif "application/pdf" in content_type:
-                    return "PDF content received. Processing of PDF files is not implemented in this example."
-                elif "image/png" in content_type:
-                    image = Image.open(BytesIO(response.content))
-                    return f"PNG image received. Size: {image.size}, Mode: {image.mode}"
-                else:
-                    return f"Received content of type: {content_type}. Raw content: {response.text[:1000]}..."
+            if "application/json" in content_type:
+                return response.json()
+            elif "application/pdf" in content_type:
+                return "PDF content received. Processing of PDF files is not implemented in this example."
+            elif "image/png" in content_type:
+                from PIL import Image
+                image = Image.open(BytesIO(response.content))
+                return f"PNG image received. Size: {image.size}, Mode: {image.mode}"
+            else:
+                return f"Received content of type: {content_type}. Raw content: {response.text[:1000]}..."
 
-            except httpx.HTTPStatusError as e:
-                return f"Error: {e.response.status_code} - {e.response.text}"
-            except Exception as e:
-                return f"An error occurred: {str(e)}"
+        except httpx.HTTPStatusError as e:
+            return f"Error: {e.response.status_code} - {e.response.text}"
+        except Exception as e:
+            return f"An error occurred: {str(e)}"
 
-    @staticmethod
-    async def query_medical_records():
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get('http://localhost:5000/get_sample_data')
-                response.raise_for_status()
-                return json.dumps(response.json(), indent=2)
-            except httpx.HTTPStatusError as e:
-                return f"Error: {e.response.status_code} - {e.response.text}"
-            except Exception as e:
-                return f"An error occurred: {str(e)}"
+    @tool(
+        "Query the server for the filenames of available medical records - only query once",
+        cache={"ttl": 30},
+        # Download and assess the listed files while the model decides which to ask for
+        on_result=prefetch_records,
+    )
+    async def query_medical_records(self):
+        client = self.http_pool.get("records")
+        try:
+            response = await client.get('/get_sample_data')
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            return f"Error: {e.response.status_code} - {e.response.text}"
+        except Exception as e:
+            return f"An error occurred: {str(e)}"
 
-    @staticmethod
-    async def download_medical_record(file_type: str, session_folder: str):
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(f'http://localhost:5000/download/{file_type}')
-                response.raise_for_status()
-                
-                file_name = f"medical_record.{file_type}"
-                file_path = os.path.join(session_folder, file_name)
-                
-                with open(file_path, 'wb') as f:
-                    f.write(response.content)
-
-                return f"File downloaded successfully. Path: {file_path}"
-            except httpx.HTTPStatusError as e:
-                return f"Error: {e.response.status_code} - {e.response.text}"
-            except Exception as e:
-                return f"An error occurred: {str(e)}"
+    @tool(
+        "Download a specific medical record from the server",
+        params={"file_type": "The type of file to download (docx, pdf, image, or txt)"},
+        cache=False,  # writes into the session folder
+        timeout=60.0,
+    )
+    async def download_medical_record(self, file_type: str, session_folder: str):
+        try:
+            file_path = os.path.join(session_folder, record_file_name(file_type))
 
-    @staticmethod
-    async def assess_file(file_path: str, session_folder: str):
-        full_path = os.path.join(session_folder, file_path)
-        if not os.path.exists(full_path):
-            return f"Error: File not found at {full_path}"
+            result = await self.prefetcher.take_download(session_folder, file_path)
+            prefetched = result is not None
+            if not prefetched:
+                result = await self.fetch_record(f'/download/{file_type}', file_path)
 
-        file_size = os.path.getsize(full_path)
-        file_ext = os.path.splitext(full_path)[1].lower()
+            return (
+                f"File downloaded successfully. Path: {file_path}\n"
+                f"Size: {result['bytes']} bytes, transferred {result['transferred']} bytes "
+                f"in {result['seconds']} s ({result['throughput_mb_s']} MB/s), "
+                f"already cached: {'yes' if result['cached'] else 'no'}"
+                f"{', prefetched' if prefetched else ''}"
+            )
+        except httpx.HTTPStatusError as e:
+            return f"Error: {e.response.status_code} - {e.response.text}"
+        except Exception as e:
+            return f"An error occurred: {str(e)}"
 
-        assessment = f"File: {os.path.basename(full_path)}\n"
-        assessment += f"File size: {file_size} bytes\n"
-        assessment += f"File type: {file_ext}\n\n"
+    @tool(
+        "Assess the content of a file and provide a summary of its properties and contents",
+        params={"file_path": "The path to the file to be assessed"},
+        cache=False,
+        timeout=30.0,
+    )
+    async def assess_file(self, file_path: str, session_folder: str):
+        full_path = resolve_session_path(session_folder, file_path)
+        if full_path is None:
+            return f"Error: {file_path} is outside the session folder"
+        if not os.path.exists(full_path):
+            return f"Error: File not found at {full_path}"
 
-        if file_ext == '.pdf':
-            try:
-                with fitz.open(full_path) as doc:
-                    assessment += f"PDF file with {len(doc)} pages.\n"
-                    toc = doc.get_toc()
-                    if toc:
-                        assessment += "Table of Contents:\n"
-                        for item in toc[:5]:  # Show first 5 ToC items
-                            assessment += f"- {' '.join(map(str, item))}\n"
-                        if len(toc) > 5:
-                            assessment += f"... and {len(toc) - 5} more items\n"
-            except Exception as e:
-                assessment += f"Unable to analyze PDF structure: {str(e)}\n"
+        assessment = await self.prefetcher.take_assessment(session_folder, full_path)
+        if assessment is not None:
+            return assessment
+        try:
+            return await self.assessment_pool.assess(full_path)
+        except asyncio.TimeoutError:
+            return f"Error: Assessment of {file_path} timed out after {self.assessment_pool.timeout} seconds"
+        except PoolFullError as e:
+            return f"Error: {str(e)}"
 
-        elif file_ext == '.docx':
-            assessment += "DOCX file. Detailed analysis would require additional libraries.\n"
+    @tool(
+        "Search the text of the PDF, DOCX and TXT files in the session folder and return the most relevant passages",
+        params={
+            "query": "Words or a question describing the information to find",
+            "top_k": "Maximum number of passages to return (default 5)"
+        },
+        cache=False,  # depends on the files in the session folder
+        timeout=60.0,
+    )
+    async def search_session_documents(self, query: str, session_folder: str, top_k: int = 5):
+        top_k = max(1, min(top_k, settings.DOCUMENT_SEARCH_MAX_RESULTS))
+        results = await self.documents.search(session_folder, query, top_k, settings.DOCUMENT_SEARCH_TOKEN_BUDGET)
+        if not results:
+            index = self.documents.sessions.get(session_folder)
+            if index is None or not index.files:
+                return "No searchable documents (PDF, DOCX or TXT) in the session folder yet. Download them first."
+            return f"No passages match: {query}"
 
-        elif file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
-            try:
-                with Image.open(full_path) as img:
-                    assessment += f"Image file. Dimensions: {img.size[0]}x{img.size[1]} pixels. Mode: {img.mode}.\n"
-            except Exception as e:
-                assessment += f"Unable to analyze image: {str(e)}\n"
+        lines = [f"{len(results)} passages matching: {query}"]
+        for score, name, location, text in results:
+            lines.append(f"\n[{name}, {location}] (score {score:.2f})\n{text}")
+        return "\n".join(lines)
 
-        elif file_ext == '.txt':
-            with open(full_path, 'r', encoding='utf-8') as text_file:
-                text_content = text_file.read()
-            line_count = text_content.count('\n') + 1
-            word_count = len(text_content.split())
-            assessment += f"Text file containing approximately {line_count} lines and {word_count} words.\n"
-            assessment += f"First 100 characters: {text_content[:100]}...\n"
+    @tool(
+        "Analyse an image or PDF from the session folder with the Pixtral vision model, e.g. to read charts, scans or handwriting",
+        params={
+            "file_path": "The path to the image or PDF, relative to the session folder",
+            "prompt": "What to look for or what question to answer about the document"
+        },
+        cache=False,
+        max_concurrency=2,
+        timeout=180.0,
+    )
+    async def analyze_document(self, file_path: str, prompt: str, session_folder: str):
+        full_path = resolve_session_path(session_folder, file_path)
+        if full_path is None:
+            return f"Error: {file_path} is outside the session folder"
+        if not os.path.exists(full_path):
+            return f"Error: File not found at {full_path}"
 
-        else:
-            assessment += f"This file has an unrecognized file type: {file_ext}\n"
+        try:
+            pixtral = load_pixtral()
+            file_ext = os.path.splitext(full_path)[1].lower()
+            if file_ext != '.pdf' and file_ext not in pixtral.IMAGE_EXTENSIONS:
+                return f"Error: analyze_document supports PDFs and images, not {file_ext} files"
 
-        return assessment
+            return await pixtral.analyze(
+                text=prompt,
+                image_paths=[full_path] if file_ext != '.pdf' else None,
+                pdf_path=full_path if file_ext == '.pdf' else None,
+                batch=file_ext == '.pdf',
+                api_key=settings.MISTRAL_API_KEY,
+                # Pages are rendered by the assessment pool's workers rather than a pool per call
+                render=self.assessment_pool.page_renderer(),
+            )
+        except Exception as e:
+            return f"An error occurred: {str(e)}"
 
 function_handler = FunctionHandler()
\ No newline at end of file
@@ -0,0 +1,77 @@
+import importlib.util
+import logging
+import httpx
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class HTTPClientPool:
+    """One pooled httpx.AsyncClient per upstream, kept alive for the app lifetime."""
+
+    def __init__(self):
+        self.upstreams = {
+            "openai": settings.OPENAI_BASE_URL,
+            "brave": settings.BRAVE_BASE_URL,
+            "portfolio": settings.PORTFOLIO_BASE_URL,
+            "records": settings.RECORDS_BASE_URL,
+        }
+        self.clients = {}
+        self.requests_sent = {}
+        self.http2 = settings.HTTP2_ENABLED
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP2_ENABLED is set but the 'h2' package is not installed, falling back to HTTP/1.1")
+            self.http2 = False
+
+    def _create_client(self, name):
+        async def count_request(request):
+            self.requests_sent[name] = self.requests_sent.get(name, 0) + 1
+
+        return httpx.AsyncClient(
+            base_url=self.upstreams[name],
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+            event_hooks={"request": [count_request]},
+        )
+
+    def get(self, name):
+        if name not in self.upstreams:
+            raise ValueError(f"Unknown upstream: {name}")
+        client = self.clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create_client(name)
+            self.clients[name] = client
+            logger.info(f"Created pooled HTTP client for {name} ({self.upstreams[name]})")
+        return client
+
+    async def start(self):
+        for name in self.upstreams:
+            self.get(name)
+
+    async def aclose(self):
+        for name, client in self.clients.items():
+            await client.aclose()
+            logger.info(f"Closed pooled HTTP client for {name}")
+        self.clients = {}
+
+    def stats(self):
+        stats = {}
+        for name, client in self.clients.items():
+            # httpx does not expose the pool publicly; read it from the transport when available
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+            idle = sum(1 for conn in connections if conn.is_idle())
+            stats[name] = {
+                "requests": self.requests_sent.get(name, 0),
+                "connections": len(connections),
+                "active": len(connections) - idle,
+                "idle": idle,
+                "max_connections": settings.HTTP_MAX_CONNECTIONS,
+                "utilisation": round((len(connections) - idle) / settings.HTTP_MAX_CONNECTIONS, 3),
+                "http2": self.http2,
+            }
+        return stats
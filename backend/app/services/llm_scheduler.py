@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying before any output has been streamed
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+class QueueFullError(Exception):
+    def __init__(self, position, retry_after):
+        super().__init__(f"LLM request queue is full ({position - 1} waiting)")
+        self.position = position
+        self.retry_after = retry_after
+
+def parse_duration(value):
+    """Parse OpenAI's reset durations such as "1s", "6m0s", "20ms" or "1h2m3.5s" into seconds."""
+    if not value:
+        return None
+    total = 0.0
+    number = ""
+    index = 0
+    while index < len(value):
+        char = value[index]
+        if char.isdigit() or char == ".":
+            number += char
+        elif value.startswith("ms", index):
+            total += float(number or 0) / 1000
+            number = ""
+            index += 1
+        elif char in "hms":
+            total += float(number or 0) * {"h": 3600, "m": 60, "s": 1}[char]
+            number = ""
+        else:
+            return None
+        index += 1
+    if number:
+        total += float(number)
+    return total
+
+def parse_retry_after(headers):
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+class Budget:
+    """Token bucket for one per-minute limit, corrected from the upstream's rate-limit headers."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit, remaining, now):
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self._refill(now)
+            self.level = min(self.level, float(remaining))
+
+class Ticket:
+    __slots__ = ("tenant", "priority", "tokens", "future", "enqueued_at")
+
+    def __init__(self, tenant, priority, tokens, future):
+        self.tenant = tenant
+        self.priority = priority
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+class LLMScheduler:
+    """Admission control and dispatch for completion requests.
+
+    At most `max_concurrency` requests stream at once, and a request is only
+    dispatched when the local requests- and tokens-per-minute budgets allow
+    it; both budgets follow the x-ratelimit-* headers of each response, and a
+    429 pauses dispatch for everyone until its retry-after has passed.
+    Waiting requests are served by priority (higher first), then round-robin
+    across tenants; beyond `max_queue` waiting, new requests are rejected.
+    """
+
+    def __init__(self, max_concurrency=32, max_queue=200, requests_per_minute=500, tokens_per_minute=200000,
+                 max_retries=4, backoff_base=0.5, backoff_max=20.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests = Budget(requests_per_minute)
+        self.tokens = Budget(tokens_per_minute)
+        self.queues = {}  # priority -> OrderedDict(tenant -> deque of tickets)
+        self.queued = 0
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.timer = None
+        self.slot_seconds = 5.0  # moving average of how long a request holds its slot
+        self.dispatched = 0
+        self.rejected = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    def check_admission(self):
+        """Raise QueueFullError when a new conversation should be turned away."""
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            position = self.queued + 1
+            retry_after = math.ceil(position * self.slot_seconds / max(self.max_concurrency, 1))
+            raise QueueFullError(position, max(retry_after, 1))
+
+    def _next_ticket(self):
+        priority = max(self.queues)
+        tenant, tickets = next(iter(self.queues[priority].items()))
+        return priority, tenant, tickets
+
+    def _schedule(self, delay):
+        self.timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.queued and self.in_flight < self.max_concurrency:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                self._schedule(self.blocked_until - now)
+                return
+            priority, tenant, tickets = self._next_ticket()
+            ticket = tickets[0]
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(ticket.tokens, now))
+            if wait > 0:
+                self._schedule(wait)
+                return
+
+            tickets.popleft()
+            tenants = self.queues[priority]
+            if tickets:
+                # Next request from this tenant goes to the back of the line
+                tenants.move_to_end(tenant)
+            else:
+                del tenants[tenant]
+                if not tenants:
+                    del self.queues[priority]
+            self.queued -= 1
+            self.requests.take(1)
+            self.tokens.take(ticket.tokens)
+            self.in_flight += 1
+            self.dispatched += 1
+            ticket.future.set_result(now - ticket.enqueued_at)
+
+    def _remove(self, ticket):
+        tenants = self.queues.get(ticket.priority, {})
+        tickets = tenants.get(ticket.tenant)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            self.queued -= 1
+            if not tickets:
+                del tenants[ticket.tenant]
+                if not tenants:
+                    del self.queues[ticket.priority]
+
+    def _release(self, held):
+        self.in_flight -= 1
+        self.slot_seconds = 0.9 * self.slot_seconds + 0.1 * held
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tenant="default", priority=0, tokens=0):
+        """Wait for permission to send one completion request and hold it while it streams."""
+        ticket = Ticket(tenant, priority, tokens, asyncio.get_running_loop().create_future())
+        self.queues.setdefault(priority, OrderedDict()).setdefault(tenant, deque()).append(ticket)
+        self.queued += 1
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                self._release(0.0)
+            else:
+                self._remove(ticket)
+            raise
+
+        start = time.monotonic()
+        try:
+            yield ticket.future.result()
+        finally:
+            self._release(time.monotonic() - start)
+
+    def update_from_headers(self, headers):
+        now = time.monotonic()
+
+        def number(name):
+            try:
+                return int(headers[name]) if headers.get(name) else None
+            except ValueError:
+                return None
+
+        self.requests.sync(number("x-ratelimit-limit-requests"), number("x-ratelimit-remaining-requests"), now)
+        self.tokens.sync(number("x-ratelimit-limit-tokens"), number("x-ratelimit-remaining-tokens"), now)
+        for kind in ("requests", "tokens"):
+            if number(f"x-ratelimit-remaining-{kind}") == 0:
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.blocked_until = max(self.blocked_until, now + reset)
+
+    def backoff(self, attempt, headers=None, rate_limited=False):
+        """Delay before retry number `attempt` (0-based): retry-after when given, else full-jitter exponential."""
+        self.retries += 1
+        retry_after = parse_retry_after(headers) if headers is not None else None
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.backoff_base)
+        else:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if rate_limited:
+            self.rate_limited += 1
+            # Everyone else would hit the same limit, so pause dispatch as well
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        return delay
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "queued_by_tenant": {
+                tenant: sum(len(tenants.get(tenant, ())) for tenants in self.queues.values())
+                for tenant in {tenant for tenants in self.queues.values() for tenant in tenants}
+            },
+            "dispatched": self.dispatched,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "paused_for": round(max(self.blocked_until - time.monotonic(), 0.0), 3),
+            "requests_budget": round(self.requests.level, 1),
+            "tokens_budget": round(self.tokens.level),
+        }
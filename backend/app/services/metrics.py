@@ -0,0 +1,158 @@
+import bisect
+import threading
+
+# Buckets in seconds unless a metric says otherwise
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.series = {}  # label values -> series state
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            series = sorted(self.series.items())
+        for key, state in series:
+            lines.extend(self._render_series(key, state))
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"]
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.series.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), sum, count; made cumulative on render
+                state = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_series(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            labels = format_labels(self.labelnames, key, ("le", format_value(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format registry, so the backend needs no client library."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+CHAT_REQUESTS = metrics.counter("chat_requests_total", "Chat responses by outcome (completed, max_turns or error)", ["outcome"])
+CHAT_RESPONSE_DURATION = metrics.histogram("chat_response_duration_seconds", "Total time to generate a chat response")
+CHAT_TURNS = metrics.histogram("chat_turns_used", "Completion turns used per response, out of max_turns", buckets=(1, 2, 3, 4, 5, 6, 8, 10))
+UPSTREAM_CONNECT = metrics.histogram("upstream_connect_seconds", "Time to open a new upstream connection, TLS included", ["upstream"])
+UPSTREAM_HEADERS = metrics.histogram("upstream_response_headers_seconds", "Time from sending a completion request to its response headers", ["upstream"])
+COMPLETION_TTFT = metrics.histogram("completion_time_to_first_token_seconds", "Time from sending a completion request to its first content or tool-call delta")
+COMPLETION_TOKENS_PER_SECOND = metrics.histogram(
+    "completion_tokens_per_second", "Completion tokens (as reported in the stream's usage) per second after the first delta, per completion turn", buckets=RATE_BUCKETS
+)
+CONTEXT_TOKENS_SAVED = metrics.counter("context_tokens_saved_total", "Prompt tokens removed by compacting or dropping earlier turns")
+TOOL_LATENCY = metrics.histogram("tool_call_duration_seconds", "Tool call latency, including cache hits", ["tool", "outcome"])
+LLM_SCHEDULER_WAIT = metrics.histogram("llm_scheduler_wait_seconds", "Time a completion request waited for a scheduler slot and rate-limit budget")
+LLM_RETRIES = metrics.counter("llm_retries_total", "Completion requests retried, by cause", ["cause"])
+COMPLETION_CACHE_LOOKUPS = metrics.counter("completion_cache_lookups_total", "Chat responses looked up in the completion cache, by result (hit or miss)", ["result"])
+COMPLETION_CACHE_STORES = metrics.counter("completion_cache_stores_total", "Chat responses offered to the completion cache, by outcome (stored or skipped)", ["outcome"])
+PREFETCH_RESULTS = metrics.counter(
+    "prefetch_results_total",
+    "Prefetched records by kind (download or assessment) and outcome (ready, waited, miss or wasted)",
+    ["kind", "outcome"],
+)
+ASSESSMENT_JOBS = metrics.gauge("assessment_pool_jobs", "File assessment jobs by state (queued or running)", ["state"])
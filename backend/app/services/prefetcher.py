@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import time
+from app.services.metrics import PREFETCH_RESULTS
+
+logger = logging.getLogger(__name__)
+
+class BandwidthLimiter:
+    """Byte-rate limit shared by all prefetches; a rate of 0 disables it."""
+
+    def __init__(self, bytes_per_second):
+        self.rate = float(bytes_per_second)
+        self.level = self.rate  # allow one second's worth of burst
+        self.updated = time.monotonic()
+
+    async def consume(self, amount):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self.level = min(self.rate, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        if self.level < 0:
+            await asyncio.sleep(-self.level / self.rate)
+
+def file_identity(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+class PrefetchEntry:
+    __slots__ = ("url", "file_path", "task", "downloaded", "assessed", "download", "assessment", "identity",
+                 "started", "promoted", "cancelled", "download_used", "assessment_used")
+
+    def __init__(self, url, file_path):
+        self.url = url
+        self.file_path = file_path
+        self.task = None
+        self.downloaded = asyncio.Event()
+        self.assessed = asyncio.Event()
+        self.download = None  # BlobStore.fetch result, None if the download failed or was cancelled
+        self.assessment = None
+        self.identity = None  # (inode, size, mtime) of the file the assessment was made from
+        self.started = False  # holds a prefetch slot
+        self.promoted = False  # a tool call is waiting on it, so bandwidth limits no longer apply
+        self.cancelled = False
+        self.download_used = False
+        self.assessment_used = False
+
+class RecordPrefetcher:
+    """Speculative download and assessment of the records a session is likely to ask for next.
+
+    Jobs are (url, file_path) pairs scheduled per session folder; each one
+    downloads the file and then assesses it, at most `max_concurrency` at a
+    time across all sessions and within a shared byte-rate limit. Tool calls
+    take the results with take_download / take_assessment, waiting for a job
+    that is still running. cancel() stops a session's running jobs and keeps
+    finished results; discard() also forgets them, counting any that were
+    never used as waste.
+    """
+
+    def __init__(self, download, assess, max_concurrency=2, bytes_per_second=0):
+        self.download = download  # async (url, file_path, throttle) -> BlobStore.fetch result
+        self.assess = assess  # async (file_path) -> assessment text
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.bandwidth = BandwidthLimiter(bytes_per_second)
+        self.sessions = {}  # session_folder -> {file_path: PrefetchEntry}
+        self.scheduled = 0
+        self.cancelled = 0
+        self.prefetched_bytes = 0
+        self.wasted_bytes = 0
+        # kind -> outcome -> count; a hit is "ready" or "waited" (the job was still running)
+        self.results = {
+            kind: {"ready": 0, "waited": 0, "miss": 0, "wasted": 0} for kind in ("download", "assessment")
+        }
+
+    def start(self, session_folder, jobs):
+        """Schedule (url, file_path) jobs for a session; files already prefetched or running are skipped."""
+        entries = self.sessions.setdefault(session_folder, {})
+        started = 0
+        for url, file_path in jobs:
+            file_path = os.path.normpath(file_path)
+            entry = entries.get(file_path)
+            if entry is not None and (entry.download is not None or not entry.task.done()):
+                continue
+            entry = entries[file_path] = PrefetchEntry(url, file_path)
+            entry.task = asyncio.ensure_future(self._run(entry))
+            started += 1
+        self.scheduled += started
+        if started:
+            logger.info(f"Prefetching {started} records into {session_folder}")
+        return started
+
+    async def _run(self, entry):
+        async def throttle(amount):
+            if not entry.promoted:
+                await self.bandwidth.consume(amount)
+
+        try:
+            async with self.slots:
+                entry.started = True
+                try:
+                    entry.download = await self.download(entry.url, entry.file_path, throttle)
+                    entry.identity = file_identity(entry.file_path)
+                    self.prefetched_bytes += entry.download["transferred"]
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Prefetch of {entry.url} failed: {str(e)}")
+                    return
+                finally:
+                    entry.downloaded.set()
+                try:
+                    entry.assessment = await self.assess(entry.file_path)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Prefetched assessment of {entry.file_path} failed: {str(e)}")
+        finally:
+            entry.downloaded.set()
+            entry.assessed.set()
+
+    def _count(self, kind, outcome):
+        self.results[kind][outcome] += 1
+        PREFETCH_RESULTS.inc(kind=kind, outcome=outcome)
+
+    async def _wait(self, entry, event):
+        """Wait for a running job, lifting its bandwidth limit; True if there was anything to wait for."""
+        if entry is None or event.is_set():
+            return False
+        if not entry.started:
+            # Still queued behind other prefetches; the caller is better off fetching it directly
+            self._cancel(entry)
+            return False
+        entry.promoted = True
+        await event.wait()
+        return True
+
+    async def take_download(self, session_folder, file_path):
+        """The prefetched download result for file_path, or None if there is none."""
+        entry = self.sessions.get(session_folder, {}).get(os.path.normpath(file_path))
+        waited = await self._wait(entry, entry and entry.downloaded)
+        if entry is None or entry.download is None or not os.path.exists(entry.file_path):
+            self._count("download", "miss")
+            return None
+        self._count("download", "waited" if waited else "ready")
+        entry.download_used = True
+        return entry.download
+
+    async def take_assessment(self, session_folder, file_path):
+        """The prefetched assessment of file_path, or None if there is none or the file has changed since."""
+        entry = self.sessions.get(session_folder, {}).get(os.path.normpath(file_path))
+        waited = await self._wait(entry, entry and entry.assessed)
+        try:
+            unchanged = entry is not None and entry.identity is not None and file_identity(entry.file_path) == entry.identity
+        except OSError:
+            unchanged = False
+        if not unchanged or entry.assessment is None:
+            self._count("assessment", "miss")
+            return None
+        self._count("assessment", "waited" if waited else "ready")
+        entry.assessment_used = True
+        return entry.assessment
+
+    def _cancel(self, entry):
+        if not entry.task.done() and not entry.cancelled:
+            entry.cancelled = True
+            entry.task.cancel()
+            self.cancelled += 1
+
+    def cancel(self, session_folder):
+        """Stop the session's running jobs; finished results stay available."""
+        for entry in self.sessions.get(session_folder, {}).values():
+            self._cancel(entry)
+
+    def discard(self, session_folder):
+        """Cancel and forget everything prefetched for the session."""
+        self.cancel(session_folder)
+        for entry in self.sessions.pop(session_folder, {}).values():
+            if entry.download is not None and not entry.download_used and not entry.assessment_used:
+                self._count("download", "wasted")
+                self.wasted_bytes += entry.download["transferred"]
+            if entry.assessment is not None and not entry.assessment_used:
+                self._count("assessment", "wasted")
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "running": sum(not entry.task.done() for entries in self.sessions.values() for entry in entries.values()),
+            "scheduled": self.scheduled,
+            "cancelled": self.cancelled,
+            "prefetched_bytes": self.prefetched_bytes,
+            "results": self.results,
+            "wasted_bytes": self.wasted_bytes,
+        }
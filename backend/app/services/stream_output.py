@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import time
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+
+    def encode_json(event):
+        return orjson.dumps(event)
+except ImportError:
+    # orjson is optional; the stdlib encoder produces the same compact output, just slower
+    def encode_json(event):
+        return json.dumps(event, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+_DONE = object()
+
+class SlowConsumerError(Exception):
+    pass
+
+def encode_frame(event, output_format):
+    if output_format == "sse":
+        return b"event: " + event["type"].encode("utf-8") + b"\ndata: " + encode_json(event) + b"\n\n"
+    return encode_json(event) + b"\n"
+
+class OutputStage:
+    """Turns the event stream of a chat response into framed bytes for the client.
+
+    Consecutive content deltas are merged until `flush_interval` seconds or
+    `flush_bytes` bytes have accumulated, and function_call_progress events
+    within the same window into one per call; any other event flushes them first.
+    Frames go through a queue of `max_buffered_frames`; a client that leaves
+    it full for `slow_client_timeout` seconds has its response aborted.
+    Limits left as None come from the STREAM_* settings, read on first use.
+    """
+
+    def __init__(self, flush_interval=None, flush_bytes=None, max_buffered_frames=None, slow_client_timeout=None):
+        self._flush_interval = flush_interval
+        self._flush_bytes = flush_bytes
+        self._max_buffered_frames = max_buffered_frames
+        self._slow_client_timeout = slow_client_timeout
+        self.responses = 0
+        self.events = 0
+        self.frames = 0
+        self.bytes = 0
+        self.aborted = 0
+
+    @property
+    def flush_interval(self):
+        return settings.STREAM_FLUSH_INTERVAL if self._flush_interval is None else self._flush_interval
+
+    @property
+    def flush_bytes(self):
+        return settings.STREAM_FLUSH_BYTES if self._flush_bytes is None else self._flush_bytes
+
+    @property
+    def max_buffered_frames(self):
+        return settings.STREAM_MAX_BUFFERED_FRAMES if self._max_buffered_frames is None else self._max_buffered_frames
+
+    @property
+    def slow_client_timeout(self):
+        return settings.STREAM_SLOW_CLIENT_TIMEOUT if self._slow_client_timeout is None else self._slow_client_timeout
+
+    async def _produce(self, events, queue, output_format, counters):
+        async def put(event):
+            frame = encode_frame(event, output_format)
+            if queue.full():
+                # asyncio.wait rather than wait_for: wait_for can swallow our own cancellation
+                # when the put completes at the same moment the client disconnects
+                putter = asyncio.ensure_future(queue.put(frame))
+                try:
+                    done, _ = await asyncio.wait({putter}, timeout=self.slow_client_timeout)
+                finally:
+                    putter.cancel()
+                if not done:
+                    raise SlowConsumerError(f"client did not read for {self.slow_client_timeout} seconds")
+            else:
+                queue.put_nowait(frame)
+            counters["frames"] += 1
+            counters["bytes"] += len(frame)
+
+        pending = []
+        pending_bytes = 0
+        progress = {}  # call id -> merged function_call_progress event
+        deadline = None
+        next_event = None
+
+        async def flush():
+            nonlocal pending, pending_bytes
+            if pending:
+                await put({"type": "content", "content": "".join(pending)})
+                pending, pending_bytes = [], 0
+            for merged in progress.values():
+                await put(merged)
+            progress.clear()
+
+        try:
+            while True:
+                if next_event is None:
+                    next_event = asyncio.ensure_future(events.__anext__())
+                timeout = max(deadline - time.monotonic(), 0) if pending or progress else None
+                done, _ = await asyncio.wait({next_event}, timeout=timeout)
+                if not done:
+                    # Flush window elapsed while the model was still thinking
+                    await flush()
+                    continue
+
+                try:
+                    event = next_event.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_event = None
+                counters["events"] += 1
+
+                if event["type"] in ("content", "function_call_progress"):
+                    if not pending and not progress:
+                        deadline = time.monotonic() + self.flush_interval
+                    if event["type"] == "content":
+                        pending.append(event["content"])
+                        pending_bytes += len(event["content"])
+                    elif event["id"] in progress:
+                        merged = progress[event["id"]]
+                        merged["delta"] += event["delta"]
+                        merged["length"] = event["length"]
+                    else:
+                        progress[event["id"]] = dict(event)
+                    if pending_bytes < self.flush_bytes and time.monotonic() < deadline:
+                        continue
+                    event = None
+                await flush()
+                if event is not None:
+                    await put(event)
+
+            await flush()
+        except SlowConsumerError as e:
+            counters["aborted"] = True
+            logger.warning(f"Aborting response stream: {str(e)}")
+            # Make room for the sentinel; the client is not reading anyway
+            while not queue.empty():
+                queue.get_nowait()
+        except Exception as e:
+            logger.error(f"Response stream failed: {str(e)}", exc_info=True)
+        finally:
+            if next_event is not None:
+                next_event.cancel()
+                await asyncio.gather(next_event, return_exceptions=True)
+            await events.aclose()
+        await queue.put(_DONE)
+
+    async def stream(self, events, output_format="ndjson"):
+        """Async generator of encoded frames for `events`, an async generator of event dicts."""
+        queue = asyncio.Queue(maxsize=self.max_buffered_frames)
+        counters = {"events": 0, "frames": 0, "bytes": 0, "aborted": False}
+        start = time.perf_counter()
+        producer = asyncio.create_task(self._produce(events, queue, output_format, counters))
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is _DONE:
+                    break
+                yield frame
+            await producer
+        finally:
+            if not producer.done():
+                # The client disconnected; stop generating for it
+                producer.cancel()
+            self.responses += 1
+            self.events += counters["events"]
+            self.frames += counters["frames"]
+            self.bytes += counters["bytes"]
+            self.aborted += counters["aborted"]
+            logger.info(
+                f"Response stream ({output_format}) finished: {counters['events']} events in {counters['frames']} frames, "
+                f"{counters['bytes']} bytes, {time.perf_counter() - start:.2f} s{' (aborted)' if counters['aborted'] else ''}"
+            )
+
+    def stats(self):
+        return {
+            "responses": self.responses,
+            "events": self.events,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "aborted": self.aborted,
+            "events_per_frame": round(self.events / self.frames, 2) if self.frames else None,
+        }
+
+output_stage = OutputStage()
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+def normalise_arguments(arguments):
+    """Canonical cache key for tool arguments: sorted keys, collapsed whitespace, integral floats as ints."""
+    def normalise(value):
+        if isinstance(value, str):
+            return " ".join(value.split())
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, dict):
+            return {key: normalise(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [normalise(item) for item in value]
+        return value
+    return json.dumps(normalise(arguments), sort_keys=True, separators=(",", ":"))
+
+class ToolResultCache:
+    """TTL + LRU cache for one tool, with single-flight for concurrent identical calls."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, result)
+        self.in_flight = {}  # key -> asyncio.Task
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, result):
+        self.entries[key] = (time.monotonic() + self.ttl, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get_or_call(self, key, call, cacheable=lambda result: True):
+        entry = self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(call())
+        self.in_flight[key] = task
+
+        def done(task):
+            self.in_flight.pop(key, None)
+            if not task.cancelled() and task.exception() is None and cacheable(task.result()):
+                self._store(key, task.result())
+
+        task.add_done_callback(done)
+        # Shield so a cancelled caller does not cancel the upstream call for everyone waiting on it
+        return await asyncio.shield(task)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+        }
@@ -0,0 +1,65 @@
+import json
+
+class ToolCall:
+    __slots__ = ("index", "id", "name", "arguments", "args", "error")
+
+    def __init__(self, index):
+        self.index = index
+        self.id = None
+        self.name = None
+        self.arguments = ""
+        self.args = None
+        self.error = None
+
+class ToolCallAssembler:
+    """Accumulates streamed tool_call deltas per call index for one completion turn.
+
+    Completion is taken from the choice's finish_reason; arguments are only
+    parsed once, in finish().
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.finish_reason = None
+
+    def add_delta(self, delta):
+        """Apply one tool_call delta and return the stream events it produces."""
+        index = delta.get("index", 0)
+        call = self.calls.get(index)
+        if call is None:
+            call = self.calls[index] = ToolCall(index)
+        if delta.get("id"):
+            call.id = delta["id"]
+
+        events = []
+        function_delta = delta.get("function") or {}
+        if function_delta.get("name"):
+            call.name = function_delta["name"]
+            events.append({"type": "function_call", "id": call.id, "function": call.name})
+        if function_delta.get("arguments"):
+            call.arguments += function_delta["arguments"]
+            events.append({
+                "type": "function_call_progress",
+                "id": call.id,
+                "function": call.name,
+                "delta": function_delta["arguments"],
+                "length": len(call.arguments),
+            })
+        return events
+
+    def finish(self, finish_reason):
+        """Close the turn and validate every call's arguments; returns calls in index order."""
+        self.finish_reason = finish_reason
+        calls = [self.calls[index] for index in sorted(self.calls)]
+        for call in calls:
+            if finish_reason not in ("tool_calls", "stop"):
+                call.error = f"Arguments for {call.name} are incomplete (finish_reason: {finish_reason})"
+                continue
+            try:
+                call.args = json.loads(call.arguments or "{}")
+            except json.JSONDecodeError as e:
+                call.error = f"Error parsing function arguments: {str(e)}"
+                continue
+            if not isinstance(call.args, dict):
+                call.error = f"Error parsing function arguments: expected an object, got {type(call.args).__name__}"
+        return calls
@@ -0,0 +1,142 @@
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+HTML_TAG = re.compile(r"<[^>]+>")
+
+# Tool results become tool messages that are resent with every later request
+# in the conversation, so they are projected down to the fields the model
+# needs, encoded compactly and cut to a byte budget first. A tool describes
+# its projection with the "output" option:
+#   items      dotted path of the list to keep, e.g. "web.results"
+#   max_items  how many of those items to keep
+#   fields     whitelist applied to each item (or to the whole result): a
+#              list of keys, or {output key: dotted source path} to rename
+#   strip_html remove markup such as <strong> from projected string fields
+#   max_bytes / max_tokens  budget for this tool instead of the default
+
+def compact_json(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def select(value, path):
+    """value["a"]["b"] for path "a.b", or None when any step is missing."""
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+def project(value, fields, strip_html=False):
+    if not isinstance(value, dict):
+        return value
+    if isinstance(fields, dict):
+        pairs = fields.items()
+    else:
+        pairs = ((field, field) for field in fields)
+    projected = {}
+    for key, path in pairs:
+        selected = select(value, path)
+        if strip_html and isinstance(selected, str):
+            selected = HTML_TAG.sub("", selected)
+        if selected is not None:
+            projected[key] = selected
+    return projected
+
+def truncate_text(text, max_bytes):
+    data = text.encode("utf-8")
+    if len(data) <= max_bytes:
+        return text
+    note = f"\n[... truncated, {len(data) - max_bytes} of {len(data)} bytes omitted]"
+    # errors="ignore" drops a multi-byte character cut in half at the boundary
+    return data[:max(max_bytes - len(note), 0)].decode("utf-8", errors="ignore") + note
+
+def fit_items(items, max_bytes):
+    """Compact JSON of the longest prefix of items that fits, noting how many were left out."""
+    encoded = [compact_json(item) for item in items]
+    full = "[" + ",".join(encoded) + "]"
+    if len(full.encode("utf-8")) <= max_bytes:
+        return full
+    size = 2  # brackets
+    kept = 0
+    for part in encoded:
+        # Leave room for the omission note in case a later item does not fit
+        if size + len(part.encode("utf-8")) + 1 + 48 > max_bytes:
+            break
+        size += len(part.encode("utf-8")) + 1
+        kept += 1
+    if kept == 0:
+        return truncate_text(full, max_bytes)
+    omitted = compact_json(f"{len(items) - kept} more items omitted")
+    return "[" + ",".join(encoded[:kept] + [omitted]) + "]"
+
+def compact_output(value, spec, max_bytes):
+    """The text that goes into the tool message for a tool's return value."""
+    if not isinstance(value, (dict, list)):
+        return truncate_text(str(value), max_bytes)
+    if spec.get("items"):
+        value = select(value, spec["items"]) if isinstance(value, dict) else value
+        value = value if isinstance(value, list) else []
+    if isinstance(value, list) and spec.get("max_items"):
+        value = value[:spec["max_items"]]
+    if spec.get("fields"):
+        fields = spec["fields"]
+        strip_html = spec.get("strip_html", False)
+        if isinstance(value, list):
+            value = [project(item, fields, strip_html) for item in value]
+        else:
+            value = project(value, fields, strip_html)
+    if isinstance(value, list):
+        return fit_items(value, max_bytes)
+    return truncate_text(compact_json(value), max_bytes)
+
+class Items(list):
+    """The items kept from a longer list; source_bytes is the compact size of the whole list."""
+
+    def __init__(self, items, source_bytes):
+        super().__init__(items)
+        self.source_bytes = source_bytes
+
+def output_size(value):
+    """Compact size of a tool result, counting what was cut before compaction saw it."""
+    if isinstance(value, Items):
+        return value.source_bytes
+    if isinstance(value, (dict, list)):
+        return len(compact_json(value).encode("utf-8"))
+    return len(str(value).encode("utf-8"))
+
+async def read_json_items(response, path, limit):
+    """The first `limit` items of the list at dotted `path` in a streamed JSON response.
+
+    With ijson installed only that list is built as the body arrives, instead
+    of the whole document; otherwise the body is parsed whole. Either way the
+    body is read to the end so the connection can go back to the pool.
+    """
+    try:
+        import ijson
+    except ImportError:
+        items = select(json.loads(await response.aread()), path)
+        items = items if isinstance(items, list) else []
+        return Items(items[:limit], output_size(items))
+
+    events = ijson.sendable_list()
+    parser = ijson.items_coro(events, f"{path}.item", use_float=True)
+    items = []
+    sizes = []
+
+    def take():
+        for item in events:
+            sizes.append(output_size(item))
+            if len(items) < limit:
+                items.append(item)
+        del events[:]
+
+    async for chunk in response.aiter_bytes():
+        parser.send(chunk)
+        take()
+    parser.close()
+    take()
+    logger.info(f"Kept {len(items)} of {len(sizes)} items from a {response.num_bytes_downloaded} byte response")
+    # Brackets plus the commas between items, as compact_json would write the whole list
+    return Items(items, sum(sizes) + max(len(sizes) - 1, 0) + 2)
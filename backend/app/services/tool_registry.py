@@ -0,0 +1,167 @@
+import inspect
+import json
+import logging
+from importlib.metadata import entry_points
+
+logger = logging.getLogger(__name__)
+
+PLUGIN_ENTRY_POINT_GROUP = "a16z_tool_ai.tools"
+
+# Parameters supplied by the backend rather than the model; never part of a tool's schema
+INJECTED_PARAMETERS = ("session_folder",)
+
+JSON_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    dict: "object",
+}
+
+PYTHON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+}
+
+def compile_validator(name, properties, required, injected):
+    """Build a validator closure for one tool; it returns the cleaned kwargs or raises ValueError."""
+    checks = [
+        (param, PYTHON_TYPES[schema["type"]], schema["type"])
+        for param, schema in properties.items()
+        if schema.get("type") in PYTHON_TYPES
+    ]
+    required = tuple(required)
+    allowed = frozenset(properties) | frozenset(injected)
+
+    def validate(kwargs):
+        missing = [param for param in required if param not in kwargs]
+        if missing:
+            raise ValueError(f"{name}: missing required arguments: {', '.join(missing)}")
+        for param, types, type_name in checks:
+            if param in kwargs:
+                value = kwargs[param]
+                # bool is a subclass of int, so it has to be ruled out explicitly
+                if not isinstance(value, types) or (isinstance(value, bool) and type_name != "boolean"):
+                    raise ValueError(f"{name}: argument '{param}' must be of type {type_name}")
+        # Drop anything the tool does not accept, e.g. session_folder for tools that don't use it
+        return {key: value for key, value in kwargs.items() if key in allowed}
+
+    return validate
+
+class Tool:
+    __slots__ = ("name", "function", "is_method", "description", "parameters", "injected", "options", "validate")
+
+    def __init__(self, name, function, description, params=None, **options):
+        self.name = name
+        self.function = function
+        self.description = description
+        self.options = options
+
+        signature = inspect.signature(function)
+        parameters = list(signature.parameters.values())
+        self.is_method = bool(parameters) and parameters[0].name == "self"
+        if self.is_method:
+            parameters = parameters[1:]
+
+        params = params or {}
+        properties = {}
+        required = []
+        injected = []
+        for parameter in parameters:
+            if parameter.name in INJECTED_PARAMETERS:
+                injected.append(parameter.name)
+                continue
+            schema = {}
+            if parameter.annotation in JSON_TYPES:
+                schema["type"] = JSON_TYPES[parameter.annotation]
+            extra = params.get(parameter.name, {})
+            schema.update({"description": extra} if isinstance(extra, str) else extra)
+            properties[parameter.name] = schema
+            if parameter.default is inspect.Parameter.empty:
+                required.append(parameter.name)
+
+        self.injected = tuple(injected)
+        self.parameters = {"type": "object", "properties": properties, "required": required}
+        self.validate = compile_validator(name, properties, required, injected)
+
+    def bind(self, owner):
+        return self.function.__get__(owner) if self.is_method else self.function
+
+    def describe(self):
+        return {"name": self.name, "description": self.description, "parameters": self.parameters}
+
+class ToolRegistry:
+    """Tools registered with @tool; schemas and the serialized tools payload are built once."""
+
+    def __init__(self, entry_point_group=PLUGIN_ENTRY_POINT_GROUP):
+        self.entry_point_group = entry_point_group
+        self.tools = {}
+        self.plugins_loaded = False
+        self._payload = None
+        self._payload_bytes = None
+
+    def tool(self, description, name=None, params=None, **options):
+        """Decorator registering a function or method as a tool.
+
+        params maps parameter names to a description string or extra JSON
+        schema keys; options (cache, timeout, max_concurrency, time_sensitive, ...) are kept
+        on the Tool for the handler to interpret. on_result is called as
+        on_result(handler, session_folder, result) after every successful
+        call, cached or not; it must not block, so it should schedule any work.
+        """
+        def decorator(function):
+            target = function.__func__ if isinstance(function, staticmethod) else function
+            self.register(Tool(name or target.__name__, target, description, params, **options))
+            return function
+        return decorator
+
+    def register(self, tool):
+        if tool.name in self.tools:
+            logger.warning(f"Tool {tool.name} is registered twice, keeping the latest definition")
+        self.tools[tool.name] = tool
+        self._payload = None
+        self._payload_bytes = None
+
+    def load_plugins(self):
+        if self.plugins_loaded:
+            return
+        self.plugins_loaded = True
+        for entry_point in entry_points(group=self.entry_point_group):
+            try:
+                # Importing the plugin module runs its @tool decorators
+                entry_point.load()
+                logger.info(f"Loaded tool plugin {entry_point.name}")
+            except Exception as e:
+                logger.error(f"Failed to load tool plugin {entry_point.name}: {str(e)}")
+
+    def get(self, name):
+        tool = self.tools.get(name)
+        if tool is None and not self.plugins_loaded:
+            self.load_plugins()
+            tool = self.tools.get(name)
+        if tool is None:
+            raise ValueError(f"Unknown function: {name}")
+        return tool
+
+    def all(self):
+        self.load_plugins()
+        return list(self.tools.values())
+
+    def payload(self):
+        """The `tools` list for a chat completion request."""
+        if self._payload is None:
+            self._payload = [{"type": "function", "function": tool.describe()} for tool in self.all()]
+        return self._payload
+
+    def payload_bytes(self):
+        if self._payload_bytes is None:
+            self._payload_bytes = json.dumps(self.payload(), separators=(",", ":")).encode("utf-8")
+        return self._payload_bytes
+
+tool_registry = ToolRegistry()
+tool = tool_registry.tool
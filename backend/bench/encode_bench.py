@@ -0,0 +1,77 @@
+"""Compare completion request-body encoding cost against conversation length.
+
+Usage (from backend/):
+    python bench/encode_bench.py --lengths 10 50 100 250 500 --repeat 200
+
+"json" is the previous approach: decode every stored message and encode
+the whole messages list with json.dumps on each turn. "spliced" is
+ChatService.build_request_body, which joins the cached prefix and the
+bytes stored with each message. Both bodies are checked to be equal as
+JSON before timing.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+for name in ("OPENAI_API_KEY", "BRAVE_API", "MISTRAL_API_KEY"):
+    os.environ.setdefault(name, "bench")
+
+from app.services.chat_service import chat_service  # noqa: E402
+from app.services.conversation_store import StoredMessage, encode_message  # noqa: E402
+from app.services.function_handler import function_handler  # noqa: E402
+
+def make_history(length):
+    history = list(chat_service.system_messages)
+    history.append(StoredMessage("system", encode_message({"role": "system", "content": "The session folder for this conversation is: /tmp/bench"})))
+    turn = 0
+    while len(history) < length:
+        turn += 1
+        for message in (
+            {"role": "user", "content": f"Question {turn}: what changed in the records since last time?"},
+            {"role": "assistant", "content": None, "tool_calls": [
+                {"id": f"call_{turn}", "type": "function", "function": {"name": "brave_search", "arguments": json.dumps({"query": f"query {turn}"})}}
+            ]},
+            {"role": "tool", "tool_call_id": f"call_{turn}", "content": json.dumps({"results": [{"title": f"Result {i}", "url": f"https://example.com/{i}", "snippet": "text " * 40} for i in range(5)]})},
+            {"role": "assistant", "content": f"Answer {turn}. " + "Some explanation. " * 30},
+        ):
+            history.append(StoredMessage(message["role"], encode_message(message)))
+    return history[:length]
+
+def json_body(history):
+    messages = [message.decode() for message in history]
+    return b"".join([
+        b'{"model":"gpt-4o-mini","stream":true,"stream_options":{"include_usage":true},"tool_choice":"auto","tools":',
+        function_handler.get_tools_payload_bytes(),
+        b',"messages":',
+        json.dumps(messages, separators=(",", ":")).encode("utf-8"),
+        b"}",
+    ])
+
+def time_per_call(function, history, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(history)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 50, 100, 250, 500])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'messages':>8} {'body KB':>8} {'json us':>10} {'spliced us':>11} {'speedup':>8}")
+    for length in args.lengths:
+        history = make_history(length)
+        body = chat_service.build_request_body(history)
+        assert json.loads(body) == json.loads(json_body(history)), "spliced body differs from json.dumps output"
+        json_us = time_per_call(json_body, history, args.repeat)
+        spliced_us = time_per_call(chat_service.build_request_body, history, args.repeat)
+        print(f"{length:>8} {len(body) / 1024:>8.1f} {json_us:>10.1f} {spliced_us:>11.1f} {json_us / spliced_us:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
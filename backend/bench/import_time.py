@@ -0,0 +1,71 @@
+"""Measure backend cold-start import time and fail when it exceeds a budget.
+
+Usage (from backend/):
+    python bench/import_time.py --runs 5 --budget-ms 1200
+
+Each run imports `main` in a fresh interpreter with -X importtime; the
+median wall time is compared against the budget and the slowest modules
+of the last run are listed. Exits with status 1 when over budget.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_once(module):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    return elapsed_ms, result.stderr
+
+def slowest_modules(importtime_output, count):
+    modules = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # Nesting is shown as two spaces per level; report what the target imports
+        # directly so that nothing is counted twice
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            modules.append((int(cumulative_us), int(self_us), name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500")))
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    timings = []
+    output = ""
+    for _ in range(args.runs):
+        elapsed_ms, output = run_once(args.module)
+        timings.append(elapsed_ms)
+
+    median_ms = statistics.median(timings)
+    print(f"import {args.module}: median {median_ms:.1f} ms, min {min(timings):.1f} ms, max {max(timings):.1f} ms over {args.runs} runs")
+    print("Slowest imports (cumulative ms, self ms):")
+    for cumulative_us, self_us, name in slowest_modules(output, args.top):
+        print(f"  {cumulative_us / 1000:8.1f} {self_us / 1000:8.1f}  {name}")
+
+    if median_ms > args.budget_ms:
+        print(f"FAIL: startup import time {median_ms:.1f} ms exceeds budget of {args.budget_ms:.0f} ms")
+        sys.exit(1)
+    print(f"OK: within budget of {args.budget_ms:.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""Drive concurrent conversations through the backend against local upstream mocks.
+
+Usage (from backend/):
+    python bench/load_test.py --conversations 200 --concurrency 20 --turns 2 --script tools
+
+By default this starts bench/mock_upstreams.py, the Flask records server
+(server/app.py) and the backend under uvicorn on free ports, with every
+upstream base URL pointed at the local stand-ins. Pass --backend-url to
+measure a backend that is already running instead.
+
+Each conversation sends its first message to /api/chat and the rest to
+/api/chat/{conversation_id}. The report has time to first content,
+end-to-end latency percentiles, throughput and the resident memory of
+the backend processes. It is written as JSON to bench/results/ (or
+--output) so runs can be compared; --baseline prints the difference
+against an earlier result file. The run fails if the backend opened a new
+connection to the (mock) OpenAI upstream for every completion request
+instead of reusing pooled keep-alive connections.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+RECORDS_APP = os.path.join(REPO_DIR, "server", "app.py")
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+
+MESSAGES = [
+    "What time is it, and what is new in AI tool calling?",
+    "Can you check my medical records and summarise them?",
+    "Thanks, can you go into more detail on the first point?",
+]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 4)
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 4),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 4),
+    }
+
+def process_tree(pid):
+    pids = [pid]
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                for child in f.read().split():
+                    pids.extend(process_tree(int(child)))
+        except FileNotFoundError:
+            pass
+    return pids
+
+def rss_bytes(pid):
+    """Resident memory of pid and its children (uvicorn workers, assessment pool), from /proc."""
+    total = 0
+    try:
+        for member in process_tree(pid):
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+    return total
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+class Stack:
+    """The mock upstreams, records server and backend as child processes."""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.backend_pid = None
+
+    def spawn(self, command, env=None, cwd=BACKEND_DIR):
+        process = subprocess.Popen(
+            command,
+            cwd=cwd,
+            env=dict(os.environ, **(env or {})),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL if not self.args.verbose else None,
+        )
+        self.processes.append(process)
+        return process
+
+    async def wait_ready(self, url, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                try:
+                    if (await client.get(url)).status_code < 500:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError(f"{url} did not become ready within {timeout} seconds")
+
+    async def start(self):
+        args = self.args
+        mock_port = free_port()
+        self.spawn([
+            sys.executable, os.path.join("bench", "mock_upstreams.py"),
+            "--port", str(mock_port),
+            "--script", args.script,
+            "--tokens-per-second", str(args.tokens_per_second),
+            "--first-token-delay", str(args.first_token_delay),
+            "--arg-chunk-size", str(args.arg_chunk_size),
+        ])
+        mock_url = f"http://127.0.0.1:{mock_port}"
+
+        records_url = args.records_url
+        if records_url is None:
+            records_port = free_port()
+            self.spawn([sys.executable, "-m", "flask", "--app", RECORDS_APP, "run", "--port", str(records_port)])
+            records_url = f"http://127.0.0.1:{records_port}"
+
+        backend_port = free_port()
+        backend = self.spawn(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(backend_port), "--workers", str(args.workers), "--log-level", "warning"],
+            env={
+                "OPENAI_API_KEY": "bench",
+                "BRAVE_API": "bench",
+                "MISTRAL_API_KEY": "bench",
+                "OPENAI_BASE_URL": f"{mock_url}/v1",
+                "BRAVE_BASE_URL": f"{mock_url}/brave/res/v1",
+                "RECORDS_BASE_URL": records_url,
+                "LOG_LEVEL": "WARNING",
+            },
+        )
+        self.backend_pid = backend.pid
+
+        await self.wait_ready(f"{mock_url}/stats")
+        await self.wait_ready(f"{records_url}/get_sample_data")
+        await self.wait_ready(f"http://127.0.0.1:{backend_port}/")
+        return f"http://127.0.0.1:{backend_port}"
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+async def send_message(client, url, message, results):
+    start = time.perf_counter()
+    result = {"ttft": None, "latency": None, "frames": 0, "bytes": 0, "content_chars": 0, "error": None, "conversation_id": None}
+    try:
+        async with client.stream("POST", url, json={"message": message}) as response:
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = f"HTTP {response.status_code}"
+            else:
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    result["frames"] += 1
+                    result["bytes"] += len(line) + 1
+                    event = json.loads(line)
+                    if event["type"] == "content" and event["content"]:
+                        if result["ttft"] is None:
+                            result["ttft"] = time.perf_counter() - start
+                        result["content_chars"] += len(event["content"])
+                    elif event["type"] == "conversation_id":
+                        result["conversation_id"] = event["id"]
+                    elif event["type"] == "error" and "id" not in event:
+                        result["error"] = event["content"]
+    except httpx.HTTPError as e:
+        result["error"] = f"{type(e).__name__}: {str(e)}"
+    result["latency"] = time.perf_counter() - start
+    results.append(result)
+    return result
+
+async def run_conversation(client, base_url, turns, results):
+    first = await send_message(client, f"{base_url}/api/chat", MESSAGES[0], results)
+    conversation_id = first["conversation_id"]
+    if conversation_id is None:
+        return
+    for turn in range(1, turns):
+        await send_message(client, f"{base_url}/api/chat/{conversation_id}", MESSAGES[turn % len(MESSAGES)], results)
+
+async def sample_rss(pid, samples, interval=0.5):
+    while True:
+        value = rss_bytes(pid)
+        if value is not None:
+            samples.append(value)
+        await asyncio.sleep(interval)
+
+async def drive(args, base_url, backend_pid):
+    results = []
+    rss_samples = []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    sampler = asyncio.create_task(sample_rss(backend_pid, rss_samples)) if backend_pid else None
+    rss_before = rss_bytes(backend_pid) if backend_pid else None
+
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(args.request_timeout)) as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one():
+            async with semaphore:
+                await run_conversation(client, base_url, args.turns, results)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.conversations)))
+        elapsed = time.perf_counter() - start
+        try:
+            health = (await client.get(f"{base_url}/health")).json()
+        except (httpx.HTTPError, ValueError):
+            health = None
+        try:
+            metrics_text = (await client.get(f"{base_url}/metrics")).text
+        except httpx.HTTPError:
+            metrics_text = ""
+
+    if sampler is not None:
+        sampler.cancel()
+    ok = [result for result in results if result["error"] is None]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_samples": sorted({result["error"] for result in results if result["error"]})[:5],
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput": {
+            "requests_per_second": round(len(results) / elapsed, 2),
+            "conversations_per_second": round(args.conversations / elapsed, 2),
+            "content_chars_per_second": round(sum(result["content_chars"] for result in ok) / elapsed, 1),
+        },
+        "ttft_seconds": percentiles([result["ttft"] for result in ok if result["ttft"] is not None]),
+        "latency_seconds": percentiles([result["latency"] for result in ok]),
+        "frames_per_request": percentiles([result["frames"] for result in ok]),
+        "bytes_per_request": percentiles([result["bytes"] for result in ok]),
+        "rss_bytes": {
+            "before": rss_before,
+            "peak": max(rss_samples) if rss_samples else None,
+            "after": rss_bytes(backend_pid) if backend_pid else None,
+        },
+        "openai_connections": connection_reuse(health, metrics_text),
+        "backend_health": health,
+    }
+
+def connection_reuse(health, metrics_text):
+    """New connections opened to the openai upstream against completion requests sent, and the idle pool left."""
+    pool = ((health or {}).get("http_pools") or {}).get("openai")
+    if pool is None:
+        return None
+    prefix = 'upstream_connect_seconds_count{upstream="openai"} '
+    connects = next((int(float(line[len(prefix):])) for line in metrics_text.splitlines() if line.startswith(prefix)), 0)
+    return {"requests": pool["requests"], "connects": connects, "idle": pool["idle"]}
+
+def compare(current, baseline):
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for section in ("ttft_seconds", "latency_seconds"):
+        for key in ("p50", "p95", "p99"):
+            old = (baseline["report"].get(section) or {}).get(key)
+            new = (current["report"].get(section) or {}).get(key)
+            if old and new:
+                print(f"  {section}.{key}: {old:.4f} -> {new:.4f} ({(new - old) / old * 100:+.1f}%)")
+    old = baseline["report"]["throughput"]["requests_per_second"]
+    new = current["report"]["throughput"]["requests_per_second"]
+    print(f"  requests_per_second: {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+
+def print_report(report):
+    print(f"{report['requests']} requests in {report['elapsed_seconds']} s, {report['errors']} errors")
+    for sample in report["error_samples"]:
+        print(f"  error: {sample}")
+    print(f"throughput: {report['throughput']}")
+    for section in ("ttft_seconds", "latency_seconds"):
+        stats = report[section]
+        if stats:
+            print(f"{section}: p50 {stats['p50']}  p90 {stats['p90']}  p99 {stats['p99']}  max {stats['max']}")
+    reuse = report["openai_connections"]
+    if reuse:
+        print(f"openai connections: {reuse['connects']} opened for {reuse['requests']} requests, {reuse['idle']} idle in the pool")
+    rss = report["rss_bytes"]
+    if rss["peak"]:
+        print(f"backend RSS: before {rss['before'] / 1e6:.1f} MB, peak {rss['peak'] / 1e6:.1f} MB, after {rss['after'] / 1e6:.1f} MB")
+
+async def main_async(args):
+    stack = None
+    backend_pid = None
+    base_url = args.backend_url
+    if base_url is None:
+        stack = Stack(args)
+        try:
+            base_url = await stack.start()
+        except Exception:
+            stack.stop()
+            raise
+        backend_pid = stack.backend_pid
+    try:
+        return await drive(args, base_url, backend_pid)
+    finally:
+        if stack is not None:
+            stack.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=2, help="messages per conversation")
+    parser.add_argument("--script", default="tools", help="mock_upstreams script: chat, tools, records or a JSON file")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--arg-chunk-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the spawned backend")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--backend-url", help="use a running backend instead of spawning the stack")
+    parser.add_argument("--records-url", help="use a running records server instead of spawning one")
+    parser.add_argument("--output", help="result file (default: bench/results/load-<time>-<commit>.json)")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show stderr of the spawned processes")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    result = {
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "verbose")},
+        "report": report,
+    }
+    print_report(report)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"load-{result['timestamp'].replace(':', '')}-{result['commit'] or 'unknown'}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved results to {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+    # Keep-alive check: completions must reuse pooled connections rather than open one each
+    reuse = report["openai_connections"]
+    if reuse and reuse["requests"] > 1 and (reuse["connects"] >= reuse["requests"] or reuse["idle"] == 0):
+        print("FAIL: openai connections are not being reused")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Local stand-ins for the OpenAI chat-completions and Brave search APIs.
+
+Usage (from backend/):
+    python bench/mock_upstreams.py --port 8100 --script tools --tokens-per-second 60
+
+Point the backend at it with
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1
+    BRAVE_BASE_URL=http://127.0.0.1:8100/brave/res/v1
+
+A script is a list of assistant turns, each with "text" and/or
+"tool_calls" ([{"name": ..., "arguments": {...}}]). The turn to play is
+the number of assistant messages since the last user message, so every
+conversation walks through the script without any server-side state.
+Use one of the built-in SCRIPTS or pass a JSON file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+ANSWER = (
+    "Here is a summary of what I found. The records describe a routine check-up with normal vital signs, "
+    "a short history of seasonal allergies and no current medication. The attached chart shows rainfall "
+    "by month, peaking in November. Let me know if you want any part of this in more detail."
+)
+
+SCRIPTS = {
+    "chat": [
+        {"text": ANSWER},
+    ],
+    "tools": [
+        {"tool_calls": [
+            {"name": "get_current_time", "arguments": {}},
+            {"name": "brave_search", "arguments": {"query": "latest developments in AI tool calling"}},
+        ]},
+        {"text": ANSWER},
+    ],
+    "records": [
+        {"tool_calls": [{"name": "query_medical_records", "arguments": {}}]},
+        {"tool_calls": [
+            {"name": "download_medical_record", "arguments": {"file_type": "pdf"}},
+            {"name": "download_medical_record", "arguments": {"file_type": "txt"}},
+        ]},
+        {"tool_calls": [{"name": "assess_file", "arguments": {"file_path": "medical_record.pdf"}}]},
+        {"text": ANSWER},
+    ],
+}
+
+def load_script(name_or_path):
+    if name_or_path in SCRIPTS:
+        return SCRIPTS[name_or_path]
+    with open(name_or_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def select_turn(script, messages):
+    turn = 0
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            break
+        if message.get("role") == "assistant":
+            turn += 1
+    return script[min(turn, len(script) - 1)]
+
+def sse(chunk):
+    return f"data: {json.dumps(chunk, separators=(',', ':'))}\n\n".encode("utf-8")
+
+def completion_chunk(completion_id, delta, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+async def stream_turn(turn, config, include_usage=False):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    delay = 1 / config["tokens_per_second"] if config["tokens_per_second"] > 0 else 0
+
+    await asyncio.sleep(config["first_token_delay"])
+    yield sse(completion_chunk(completion_id, {"role": "assistant", "content": ""}))
+
+    # One chunk per word stands in for one token
+    tokens = 0
+    for word in (turn.get("text") or "").split():
+        yield sse(completion_chunk(completion_id, {"content": word + " "}))
+        tokens += 1
+        if delay:
+            await asyncio.sleep(delay)
+
+    tool_calls = turn.get("tool_calls") or []
+    size = config["arg_chunk_size"]
+    for index, call in enumerate(tool_calls):
+        call_id = f"call_{uuid.uuid4().hex[:12]}"
+        yield sse(completion_chunk(completion_id, {"tool_calls": [
+            {"index": index, "id": call_id, "type": "function", "function": {"name": call["name"], "arguments": ""}}
+        ]}))
+        arguments = json.dumps(call.get("arguments", {}))
+        for start in range(0, len(arguments), size):
+            yield sse(completion_chunk(completion_id, {"tool_calls": [
+                {"index": index, "function": {"arguments": arguments[start:start + size]}}
+            ]}))
+            tokens += 1
+            if delay:
+                await asyncio.sleep(delay)
+
+    yield sse(completion_chunk(completion_id, {}, "tool_calls" if tool_calls else "stop"))
+    if include_usage:
+        yield sse({"id": completion_id, "object": "chat.completion.chunk", "model": "gpt-4o-mini", "choices": [],
+                   "usage": {"prompt_tokens": 0, "completion_tokens": tokens, "total_tokens": tokens}})
+    yield b"data: [DONE]\n\n"
+
+def create_app(config):
+    app = FastAPI()
+    app.state.requests = {"chat_completions": 0, "brave_search": 0}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests["chat_completions"] += 1
+        body = await request.json()
+        turn = select_turn(config["script"], body.get("messages", []))
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        return StreamingResponse(stream_turn(turn, config, include_usage), media_type="text/event-stream")
+
+    @app.get("/brave/res/v1/web/search")
+    async def brave_search(q: str = ""):
+        app.state.requests["brave_search"] += 1
+        await asyncio.sleep(config["search_latency"])
+        return JSONResponse({
+            "type": "search",
+            "query": {"original": q},
+            "web": {"results": [
+                {
+                    "title": f"Result {rank} for {q}",
+                    "url": f"https://example.com/{rank}",
+                    "description": f"Snippet {rank} about {q}. " * 8,
+                    "age": "1 day ago",
+                    "meta_url": {"hostname": "example.com", "path": f"/{rank}"},
+                }
+                for rank in range(1, config["search_results"] + 1)
+            ]},
+        })
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.requests
+
+    return app
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--script", default=os.getenv("MOCK_SCRIPT", "tools"), help=f"one of {', '.join(SCRIPTS)} or a JSON file")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0, help="0 streams as fast as possible")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="seconds before the first chunk")
+    parser.add_argument("--arg-chunk-size", type=int, default=8, help="characters of tool-call arguments per chunk")
+    parser.add_argument("--search-latency", type=float, default=0.15)
+    parser.add_argument("--search-results", type=int, default=10)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = {
+        "script": load_script(args.script),
+        "tokens_per_second": args.tokens_per_second,
+        "first_token_delay": args.first_token_delay,
+        "arg_chunk_size": max(args.arg_chunk_size, 1),
+        "search_latency": args.search_latency,
+        "search_results": args.search_results,
+    }
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
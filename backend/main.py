@@ -1,17 +1,50 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.chat import router as chat_router
-from fastapi.responses import JSONResponse
+from app.core.config import settings
+from app.core.logging_config import buffer_early_logs, setup_logging
+from app.services.chat_service import chat_service
+from app.services.function_handler import function_handler
+from app.services.http_client import HTTPClientPool
+from app.services.metrics import metrics
+from app.services.stream_output import output_stage
+from fastapi.responses import JSONResponse, PlainTextResponse
 import uvicorn
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
+# Logging is set up in lifespan; until then records are held and replayed there
+buffer_early_logs()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Configured here rather than at import, so importing main does not build Settings
+    # (records logged before this point were buffered and are replayed now)
+    setup_logging(
+        level=settings.LOG_LEVEL,
+        max_chars=settings.LOG_MAX_MESSAGE_CHARS,
+        sample_rate=settings.LOG_SAMPLE_RATE,
+    )
+    logger.info(f"App routes: {[route.path for route in app.routes]}")
+    http_pool = HTTPClientPool()
+    await http_pool.start()
+    chat_service.http_pool = http_pool
+    function_handler.http_pool = http_pool
+    app.state.http_pool = http_pool
+    logger.info("HTTP connection pools started")
+    if settings.PREWARM_IMPORTS:
+        await asyncio.to_thread(function_handler.prewarm)
+    yield
+    await http_pool.aclose()
+    await chat_service.conversations.close()
+    function_handler.shutdown()
+    logger.info("HTTP connection pools closed")
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -33,7 +66,24 @@ async def root():
 @app.get("/health")
 async def status():
     logger.info("Received request to health endpoint")
-    return {"status": "Healthy"}
+    return {
+        "status": "Healthy",
+        "http_pools": app.state.http_pool.stats(),
+        "conversations": chat_service.conversations.stats(),
+        "context": chat_service.context.stats(),
+        "tool_cache": function_handler.cache_stats(),
+        "blob_store": function_handler.blob_store.stats(),
+        "assessment_pool": function_handler.assessment_pool.stats(),
+        "prefetch": function_handler.prefetcher.stats(),
+        "documents": function_handler.documents.stats(),
+        "response_streams": output_stage.stats(),
+        "llm_scheduler": chat_service.scheduler.stats(),
+        "completion_cache": chat_service.completion_cache.stats() if chat_service.completion_cache else None,
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -43,9 +93,6 @@ async def global_exception_handler(request: Request, exc: Exception):
         content={"detail": f"An unexpected error occurred: {str(exc)}"},
     )
 
-# Add this line for debugging
-logger.info(f"App routes: {[route.path for route in app.routes]}")
-
 if __name__ == "__main__":
     logger.info("Starting the FastAPI application")
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
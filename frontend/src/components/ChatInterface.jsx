@@ -39,6 +39,7 @@ const ChatInterface = () => {
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
       let aiMessage = { role: 'assistant', content: '' };
+      let buffered = '';
 
       setMessages(prev => [...prev, aiMessage]);
 
@@ -46,8 +47,11 @@ const ChatInterface = () => {
         const { done, value } = await reader.read();
         if (done) break;
 
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n').filter(line => line.trim() !== '');
+        // Frames can be split across reads; keep the trailing partial line for the next one
+        buffered += decoder.decode(value, { stream: true });
+        const parts = buffered.split('\n');
+        buffered = parts.pop();
+        const lines = parts.filter(line => line.trim() !== '');
         
         for (const line of lines) {
           try {
@@ -61,6 +65,9 @@ const ChatInterface = () => {
                 setFunctionCall(parsedChunk.function);
                 aiMessage.content += `\n\n*Calling function: ${parsedChunk.function}*\n\n`;
                 break;
+              case 'function_call_progress':
+                setFunctionCall(`${parsedChunk.function} (${parsedChunk.length} chars of arguments)`);
+                break;
               case 'function_response':
                 aiMessage.content += `\n\n*Function response:*\n\`\`\`json\n${parsedChunk.content}\n\`\`\`\n\n`;
                 setFunctionCall(null);
@@ -0,0 +1,3 @@
+from .mistral_example import IMAGE_EXTENSIONS, analyze, get_client, process_input, process_input_batched
+
+__all__ = ["IMAGE_EXTENSIONS", "analyze", "get_client", "process_input", "process_input_batched"]
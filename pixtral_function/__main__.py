@@ -0,0 +1,109 @@
+"""Analyse every PDF and image in a directory with Pixtral.
+
+Usage (from the repository root):
+    python -m pixtral_function path/to/records --prompt "Summarise this document" --concurrency 4
+
+Results are appended to a JSONL manifest (results.jsonl in the directory by
+default) as each document finishes. Re-running skips documents that already
+have a successful entry for the same content hash, so an interrupted run
+resumes where it stopped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from .mistral_example import IMAGE_EXTENSIONS, analyze, get_client, image_cache
+
+PDF_EXTENSIONS = (".pdf",)
+
+def find_documents(directory):
+    documents = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(PDF_EXTENSIONS + IMAGE_EXTENSIONS):
+                documents.append(os.path.join(root, name))
+    return sorted(documents)
+
+def load_manifest(manifest_path):
+    done = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a partially written last line from an interrupted run
+                if entry.get("status") == "ok":
+                    done.add((entry["path"], entry["sha256"]))
+    return done
+
+async def run(args):
+    manifest_path = args.manifest or os.path.join(args.directory, "results.jsonl")
+    done = load_manifest(manifest_path)
+    pending = []
+    for path in find_documents(args.directory):
+        relative_path = os.path.relpath(path, args.directory)
+        sha256 = image_cache.content_hash(path)
+        if (relative_path, sha256) not in done:
+            pending.append((path, relative_path, sha256))
+    print(f"{len(pending)} documents to analyse ({len(done)} already in {manifest_path})")
+    if not pending:
+        return
+
+    client = get_client()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    manifest = open(manifest_path, "a", encoding="utf-8")
+    counts = {"ok": 0, "error": 0}
+    start = time.perf_counter()
+
+    async def process(path, relative_path, sha256):
+        is_pdf = path.lower().endswith(PDF_EXTENSIONS)
+        async with semaphore:
+            doc_start = time.perf_counter()
+            entry = {"path": relative_path, "sha256": sha256}
+            try:
+                entry["answer"] = await analyze(
+                    text=args.prompt,
+                    image_paths=None if is_pdf else [path],
+                    pdf_path=path if is_pdf else None,
+                    pdf_pages=args.pages,
+                    dpi=args.dpi,
+                    max_pixels=args.max_pixels,
+                    batch=args.batch,
+                    client=client,
+                )
+                entry["status"] = "ok"
+            except Exception as e:
+                entry["status"] = "error"
+                entry["error"] = str(e)
+            entry["seconds"] = round(time.perf_counter() - doc_start, 3)
+        manifest.write(json.dumps(entry) + "\n")
+        manifest.flush()
+        counts[entry["status"]] += 1
+        print(f"[{counts['ok'] + counts['error']}/{len(pending)}] {relative_path}: {entry['status']} in {entry['seconds']} s")
+
+    try:
+        await asyncio.gather(*(process(*document) for document in pending))
+    finally:
+        manifest.close()
+    elapsed = time.perf_counter() - start
+    print(f"Processed {len(pending)} documents in {elapsed:.1f} s ({len(pending) / elapsed:.2f} docs/s), "
+          f"{counts['ok']} ok, {counts['error']} failed")
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m pixtral_function", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--prompt", default="Analyze this document paying attention to the charts and graphs")
+    parser.add_argument("--manifest", help="JSONL results file (default: <directory>/results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch", action="store_true", help="split large documents into concurrent chunks")
+    parser.add_argument("--pages", help="1-based page range for PDFs, e.g. 1-3,7")
+    parser.add_argument("--dpi", type=int, default=72)
+    parser.add_argument("--max-pixels", type=int)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,314 @@
 import os
+import asyncio
 import base64
+import hashlib
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from itertools import islice
 from mistralai import Mistral
 from dotenv import load_dotenv
 import fitz  # PyMuPDF
-from pdf2image import convert_from_path
-import fitz  # PyMuPDF
 
-# Load the .env file
-load_dotenv()
-api_key = os.getenv("API_KEY")
+logger = logging.getLogger(__name__)
 
-# Initialize the Mistral client
 model = "pixtral-12b-2409"
-client = Mistral(api_key=api_key)
-
-# Function to encode image as base64
-def encode_image_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-
-def extract_images_from_pdf(pdf_path):
-    images = []
-    pdf_document = fitz.open(pdf_path)
-    
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)  # Load each page
-        pix = page.get_pixmap()  # Get page image as Pixmap
-        page_image_path = f"page_{page_num}.jpeg"
-        pix.save(page_image_path)  # Save the image
-        images.append(encode_image_base64(page_image_path))
-    
-    return images
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp")
+_clients = {}
 
-# Main function to process inputs and return text output
-def process_input(text=None, image_paths=None, pdf_path=None):
-    content = []
+def get_client(api_key=None):
+    """Mistral client for api_key; by default MISTRAL_API_KEY (or API_KEY) from the environment or .env."""
+    if api_key is None:
+        load_dotenv()
+        api_key = os.getenv("MISTRAL_API_KEY") or os.getenv("API_KEY")
+    client = _clients.get(api_key)
+    if client is None:
+        client = _clients[api_key] = Mistral(api_key=api_key)
+    return client
 
-    # Add text content if provided
-    if text:
-        content.append({
-            "type": "text",
-            "text": text
-        })
+# Image preprocessing: downscale to the resolution the model actually uses,
+# re-encode without metadata and cache the result by content hash
+
+MAX_IMAGE_SIDE = 1024  # Pixtral downsamples larger images anyway
+IMAGE_QUALITY = 85
+IMAGE_CACHE_DIR = os.getenv("PIXTRAL_IMAGE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "pixtral_images"))
+IMAGE_CACHE_ENTRIES = 128
+IMAGE_HASH_ENTRIES = 4096
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("PIXTRAL_IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+IMAGE_CACHE_MAX_AGE = int(os.getenv("PIXTRAL_IMAGE_CACHE_MAX_AGE", 30 * 24 * 3600))  # seconds since last use
+IMAGE_CACHE_PRUNE_INTERVAL = 3600
+IMAGE_CACHE_VERSION = 2  # bump when preprocess_image output changes, so stale cached files are not reused
+
+class EncodedImageCache:
+    """LRU of base64-encoded preprocessed images in memory, backed by files on disk.
+
+    The directory is shared by every process using it, so it is bounded by
+    scanning it: files unused for max_age seconds are removed, then the least
+    recently used ones until it holds at most max_bytes (0 disables either).
+    A file's mtime is its last use.
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_entries=IMAGE_CACHE_ENTRIES, max_hashes=IMAGE_HASH_ENTRIES,
+                 max_bytes=IMAGE_CACHE_MAX_BYTES, max_age=IMAGE_CACHE_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_hashes = max_hashes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.file_hashes = OrderedDict()  # (path, mtime, size) -> sha256, so unchanged files are not re-read
+        self.disk_bytes = None  # estimate since the last prune; None until the directory is scanned
+        self.next_prune = 0
+
+    def content_hash(self, image_path):
+        stat = os.stat(image_path)
+        file_key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+        digest = self.file_hashes.get(file_key)
+        if digest is not None:
+            self.file_hashes.move_to_end(file_key)
+            return digest
+        hasher = hashlib.sha256()
+        with open(image_path, "rb") as image_file:
+            for block in iter(lambda: image_file.read(1024 * 1024), b""):
+                hasher.update(block)
+        digest = self.file_hashes[file_key] = hasher.hexdigest()
+        while len(self.file_hashes) > self.max_hashes:
+            self.file_hashes.popitem(last=False)
+        return digest
+
+    def get(self, key):
+        encoded = self.entries.get(key)
+        if encoded is not None:
+            self.entries.move_to_end(key)
+            return encoded
+        path = os.path.join(self.cache_dir, key)
+        try:
+            with open(path, "r", encoding="ascii") as cached_file:
+                encoded = cached_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None  # never cached, or pruned by another process
+        self._remember(key, encoded)
+        return encoded
+
+    def put(self, key, encoded):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = os.path.join(self.cache_dir, f"{key}.tmp{os.getpid()}")
+        with open(tmp_path, "w", encoding="ascii") as cached_file:
+            cached_file.write(encoded)
+        os.replace(tmp_path, os.path.join(self.cache_dir, key))
+        self._remember(key, encoded)
+        if self.disk_bytes is not None:
+            self.disk_bytes += len(encoded)
+        over_size = self.max_bytes and (self.disk_bytes is None or self.disk_bytes > self.max_bytes)
+        if over_size or (self.max_age and time.monotonic() >= self.next_prune):
+            self.prune()
+
+    def prune(self):
+        """Remove expired and least recently used files until the directory fits; returns how many."""
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        cutoff = time.time() - self.max_age if self.max_age else None
+        removed = 0
+        for mtime, size, path in files:
+            expired = cutoff is not None and mtime < cutoff
+            if not expired and not (self.max_bytes and total > self.max_bytes):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self.disk_bytes = total
+        self.next_prune = time.monotonic() + IMAGE_CACHE_PRUNE_INTERVAL
+        if removed:
+            logger.info(f"Pruned {removed} cached images, {total} bytes left in {self.cache_dir}")
+        return removed
+
+    def _remember(self, key, encoded):
+        self.entries[key] = encoded
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+image_cache = EncodedImageCache()
+
+def preprocess_image(image_path, max_side=MAX_IMAGE_SIDE, quality=IMAGE_QUALITY, cache=image_cache):
+    """Return the image resized to max_side, re-encoded as JPEG without metadata, base64-encoded."""
+    key = f"{cache.content_hash(image_path)}-{max_side}-{quality}-v{IMAGE_CACHE_VERSION}"
+    encoded = cache.get(key)
+    if encoded is not None:
+        return encoded
+
+    from PIL import Image, ImageOps
+    original_bytes = os.path.getsize(image_path)
+    with Image.open(image_path) as img:
+        # Apply the EXIF orientation before the metadata is dropped
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = BytesIO()
+        # Saving without exif/icc_profile strips the metadata
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    # Always the re-encoded image, even when it is not smaller: the original
+    # bytes would carry EXIF (GPS, orientation) that must not leave the host
+    data = buffer.getvalue()
+    encoded = base64.b64encode(data).decode("utf-8")
+    cache.put(key, encoded)
+    logger.info(f"Preprocessed {image_path}: {original_bytes} -> {len(data)} bytes (saved {original_bytes - len(data)})")
+    return encoded
+
+# Documents recently opened by this worker process, reused across the pages it
+# renders; workers may be long-lived (see extract_images_from_pdf's render), so
+# only a few stay open and a changed file is reopened
+OPEN_DOCUMENTS = 4
+_open_documents = OrderedDict()
+
+def open_document(pdf_path):
+    stat = os.stat(pdf_path)
+    key = (pdf_path, stat.st_mtime_ns, stat.st_size)
+    pdf_document = _open_documents.get(key)
+    if pdf_document is None:
+        pdf_document = _open_documents[key] = fitz.open(pdf_path)
+        while len(_open_documents) > OPEN_DOCUMENTS:
+            _open_documents.popitem(last=False)[1].close()
+    _open_documents.move_to_end(key)
+    return pdf_document
+
+def parse_page_range(spec, page_count):
+    """Turn a 1-based spec such as "1-3,7" into 0-based page indices."""
+    pages = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            first = int(first) if first else 1
+            last = int(last) if last else page_count
+            pages.extend(range(first - 1, min(last, page_count)))
+        else:
+            pages.append(int(part) - 1)
+    return [page for page in pages if 0 <= page < page_count]
+
+def select_pages(pages, page_count):
+    """0-based indices of the pages to render: all of them for None, else as parse_page_range or a filtered iterable."""
+    if pages is None:
+        return list(range(page_count))
+    if isinstance(pages, str):
+        return parse_page_range(pages, page_count)
+    return [page for page in pages if 0 <= page < page_count]
+
+def render_page(pdf_path, page_num, dpi=72, max_pixels=None, image_format="jpeg", quality=85):
+    """Render one page to an encoded image in memory and return it base64-encoded."""
+    page = open_document(pdf_path).load_page(page_num)
+    zoom = dpi / 72
+    if max_pixels:
+        # Scale down so width * height stays under max_pixels
+        page_pixels = page.rect.width * page.rect.height * zoom * zoom
+        if page_pixels > max_pixels:
+            zoom *= (max_pixels / page_pixels) ** 0.5
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    if image_format == "jpeg":
+        data = pix.tobytes("jpeg", jpg_quality=quality)
+    else:
+        data = pix.tobytes(image_format)
+    return base64.b64encode(data).decode("utf-8")
+
+def extract_images_from_pdf(pdf_path, pages=None, dpi=72, max_pixels=None, image_format="jpeg", quality=85, workers=None,
+                            render=None):
+    """Yield base64-encoded page images in page order.
+
+    pages is a 1-based range string ("1-3,7") or an iterable of 0-based
+    indices; all pages by default. Pages are rendered in a process pool and
+    at most a few per worker are in flight, so memory stays flat no matter
+    how long the document is. render(pdf_path, page_num, dpi, max_pixels,
+    image_format, quality) -> concurrent.futures.Future submits a page to
+    the caller's own pool instead of a new one (workers, or render.workers,
+    then only sets how many pages are in flight).
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        page_numbers = select_pages(pages, len(pdf_document))
+    if not page_numbers:
+        return
+
+    workers = workers or getattr(render, "workers", None) or min(len(page_numbers), os.cpu_count() or 1)
+    if render is not None:
+        yield from render_pages(render, pdf_path, page_numbers, workers * 2, dpi, max_pixels, image_format, quality)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        submit = partial(executor.submit, render_page)
+        yield from render_pages(submit, pdf_path, page_numbers, workers * 2, dpi, max_pixels, image_format, quality)
 
+def render_pages(render, pdf_path, page_numbers, window, *options):
+    """Yield rendered pages in order, keeping at most window of them in flight."""
+    in_flight = deque()
+    page_iter = iter(page_numbers)
+    try:
+        for page_num in islice(page_iter, window):
+            in_flight.append(render(pdf_path, page_num, *options))
+        while in_flight:
+            encoded_page = in_flight.popleft().result()
+            next_page = next(page_iter, None)
+            if next_page is not None:
+                in_flight.append(render(pdf_path, next_page, *options))
+            yield encoded_page
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+def iter_image_items(image_paths=None, pdf_path=None, pdf_pages=None, dpi=72, max_pixels=None, render=None):
+    """Yield (label, content item) for every image and rendered PDF page, lazily."""
     # Add images from file paths if provided
     if image_paths:
         for image_path in image_paths:
-            encoded_image = encode_image_base64(image_path)
-            content.append({
+            encoded_image = preprocess_image(image_path)
+            yield os.path.basename(image_path), {
                 "type": "image_url",
                 "image_url": f"data:image/jpeg;base64,{encoded_image}"
-            })
+            }
 
     # Process PDF to extract images
     if pdf_path:
-        pdf_images = extract_images_from_pdf(pdf_path)
-        for encoded_image in pdf_images:
-            content.append({
+        with fitz.open(pdf_path) as pdf_document:
+            # Filtered here exactly as extract_images_from_pdf does, so labels line up with the pages it yields
+            page_numbers = select_pages(pdf_pages, len(pdf_document))
+        pdf_images = extract_images_from_pdf(pdf_path, pages=page_numbers, dpi=dpi, max_pixels=max_pixels, render=render)
+        for page_num, encoded_image in zip(page_numbers, pdf_images):
+            yield f"{os.path.basename(pdf_path)} page {page_num + 1}", {
                 "type": "image_url",
                 "image_url": f"data:image/jpeg;base64,{encoded_image}"
-            })
+            }
+
+# Main function to process inputs and return text output
+def process_input(text=None, image_paths=None, pdf_path=None, pdf_pages=None, dpi=72, max_pixels=None, client=None):
+    content = []
+
+    # Add text content if provided
+    if text:
+        content.append({
+            "type": "text",
+            "text": text
+        })
+
+    for _, item in iter_image_items(image_paths, pdf_path, pdf_pages, dpi, max_pixels):
+        content.append(item)
 
     # Make the API request to Mistral's Pixtral model
-    chat_response = client.chat.complete(
+    chat_response = (client or get_client()).chat.complete(
         model=model,
         messages=[{
             "role": "user",
@@ -73,10 +319,145 @@ def process_input(text=None, image_paths=None, pdf_path=None):
     # Return the response from the model
     return chat_response.choices[0].message.content
 
-# Example usage
-response = process_input(
-    text="Analyze this PDF paying attention to the charts and graphsand image",
-    image_paths=["rainfall.jpg"],
-    pdf_path="patient_report.pdf"
-)
-print(response)
+# Batch mode: split large inputs into chunks under a payload budget, analyse
+# the chunks concurrently and merge the partial answers in a reduce call
+
+DEFAULT_PAYLOAD_BUDGET = 4 * 1024 * 1024  # bytes of base64 image data per request
+DEFAULT_CONCURRENCY = 4
+MAX_RETRIES = 5
+
+async def complete_with_backoff(messages, max_retries=MAX_RETRIES, client=None):
+    """Async chat completion that backs off on 429s; returns (content, retries)."""
+    client = client or get_client()
+    for attempt in range(max_retries + 1):
+        try:
+            chat_response = await client.chat.complete_async(model=model, messages=messages)
+            return chat_response.choices[0].message.content, attempt
+        except Exception as e:
+            if getattr(e, "status_code", None) != 429 or attempt == max_retries:
+                raise
+            retry_after = None
+            raw_response = getattr(e, "raw_response", None)
+            if raw_response is not None:
+                retry_after = raw_response.headers.get("retry-after")
+            delay = float(retry_after) if retry_after else min(2 ** attempt, 30)
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+def chunk_by_budget(items, payload_budget):
+    """Group (label, item) pairs into lists whose image data stays under payload_budget."""
+    chunk = []
+    chunk_bytes = 0
+    for label, item in items:
+        item_bytes = len(item["image_url"])
+        if chunk and chunk_bytes + item_bytes > payload_budget:
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append((label, item))
+        chunk_bytes += item_bytes
+    if chunk:
+        yield chunk
+
+async def process_input_batched(text=None, image_paths=None, pdf_path=None, pdf_pages=None, dpi=72, max_pixels=None,
+                                payload_budget=DEFAULT_PAYLOAD_BUDGET, concurrency=DEFAULT_CONCURRENCY, client=None, render=None):
+    """Chunked, concurrent variant of process_input; returns (answer, report)."""
+    start = time.perf_counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    question = text or "Analyze these images."
+
+    async def analyse_chunk(index, chunk):
+        labels = [label for label, _ in chunk]
+        content = [{
+            "type": "text",
+            "text": f"{question}\n\nThis request covers part {index + 1} of a larger input: {', '.join(labels)}. "
+                    "Report only what these images show."
+        }] + [item for _, item in chunk]
+        async with semaphore:
+            chunk_start = time.perf_counter()
+            answer, retries = await complete_with_backoff([{"role": "user", "content": content}], client=client)
+        return answer, {
+            "chunk": index + 1,
+            "items": labels,
+            "bytes": sum(len(item["image_url"]) for _, item in chunk),
+            "seconds": round(time.perf_counter() - chunk_start, 3),
+            "retries": retries,
+        }
+
+    # Chunks are scheduled as soon as they are filled, while later pages are still rendering
+    items = iter_image_items(image_paths, pdf_path, pdf_pages, dpi, max_pixels, render)
+    chunks = chunk_by_budget(items, payload_budget)
+    tasks = []
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(None, next, chunks, None)
+        if chunk is None:
+            break
+        tasks.append(asyncio.create_task(analyse_chunk(len(tasks), chunk)))
+    results = await asyncio.gather(*tasks)
+
+    reduce_seconds = 0.0
+    if len(results) == 1:
+        answer = results[0][0]
+    else:
+        partials = "\n\n".join(f"Part {report['chunk']} ({', '.join(report['items'])}):\n{partial}" for partial, report in results)
+        reduce_start = time.perf_counter()
+        answer, _ = await complete_with_backoff([{
+            "role": "user",
+            "content": f"{question}\n\nThe input was analysed in parts. Combine these partial analyses into one answer:\n\n{partials}"
+        }], client=client)
+        reduce_seconds = time.perf_counter() - reduce_start
+
+    report = {
+        "chunks": [chunk_report for _, chunk_report in results],
+        "reduce_seconds": round(reduce_seconds, 3),
+        "wall_seconds": round(time.perf_counter() - start, 3),
+    }
+    return answer, report
+
+async def analyze(text=None, image_paths=None, pdf_path=None, pdf_pages=None, dpi=72, max_pixels=None,
+                  batch=False, api_key=None, client=None, render=None, **batch_options):
+    """Analyse images and/or a PDF with Pixtral and return the model's answer.
+
+    Rendering and image preprocessing run in worker threads/processes so the
+    caller's event loop is never blocked; render hands PDF pages to the
+    caller's pool (see extract_images_from_pdf). With batch=True the input is
+    split into chunks (see process_input_batched; batch_options are passed on).
+    """
+    client = client or get_client(api_key)
+    if batch:
+        answer, _ = await process_input_batched(text, image_paths, pdf_path, pdf_pages, dpi, max_pixels,
+                                                client=client, render=render, **batch_options)
+        return answer
+
+    content = []
+    if text:
+        content.append({"type": "text", "text": text})
+    items = await asyncio.to_thread(lambda: list(iter_image_items(image_paths, pdf_path, pdf_pages, dpi, max_pixels, render)))
+    content.extend(item for _, item in items)
+    answer, _ = await complete_with_backoff([{"role": "user", "content": content}], client=client)
+    return answer
+
+def compare_modes(**kwargs):
+    """Run the single-shot and batched paths on the same input and print their timings."""
+    start = time.perf_counter()
+    try:
+        process_input(**kwargs)
+        single_shot = f"{time.perf_counter() - start:.2f} s"
+    except Exception as e:
+        single_shot = f"failed after {time.perf_counter() - start:.2f} s ({e})"
+    _, report = asyncio.run(process_input_batched(**kwargs))
+    for chunk_report in report["chunks"]:
+        print(f"chunk {chunk_report['chunk']}: {len(chunk_report['items'])} items, {chunk_report['bytes']} bytes, "
+              f"{chunk_report['seconds']} s, {chunk_report['retries']} retries")
+    print(f"reduce: {report['reduce_seconds']} s")
+    print(f"batched wall-clock: {report['wall_seconds']} s, single-shot: {single_shot}")
+    return report
+
+# Example usage; see `python -m pixtral_function --help` for the directory batch CLI
+if __name__ == "__main__":
+    response = asyncio.run(analyze(
+        text="Analyze this PDF paying attention to the charts and graphsand image",
+        image_paths=["rainfall.jpg"],
+        pdf_path="patient_report.pdf"
+    ))
+    print(response)
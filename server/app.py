@@ -1,21 +1,184 @@
-from flask import Flask, send_file
+from flask import Flask, jsonify, request, send_file
+import gzip
+import hashlib
+import mimetypes
 import os
+import threading
+import time
+from collections import OrderedDict
 
 app = Flask(__name__)
 
 SAMPLE_DATA_DIR = os.path.join(os.path.dirname(__file__), "sample_data")
 
+# Aliases served by the original /download/<file_type> endpoint
+LEGACY_FILES = {
+    "docx": "patient_report.docx",
+    "pdf": "patient_report.pdf",
+    "image": "rainfall.jpg",
+    "txt": "test.txt",
+}
+
+# Files are re-stat'ed at most this often; a changed directory mtime triggers a rescan immediately
+MANIFEST_RESCAN_SECONDS = float(os.getenv("MANIFEST_RESCAN_SECONDS", "5"))
+MANIFEST_DEFAULT_PAGE_SIZE = 100
+MANIFEST_MAX_PAGE_SIZE = 1000
+
+GZIP_ENABLED = os.getenv("RECORDS_GZIP", "1") == "1"
+GZIP_MIN_BYTES = 1024
+GZIP_MAX_BYTES = 8 * 1024 * 1024
+GZIP_CACHE_ENTRIES = 64
+GZIP_TYPES = ("text/", "application/json", "application/xml")
+
+class RecordIndex:
+    """Precomputed manifest of the files in a directory.
+
+    Each record carries size, mtime, sha256 and MIME type. Hashes are only
+    recomputed for files whose size or mtime changed since the last scan.
+    """
+
+    def __init__(self, root, rescan_seconds=MANIFEST_RESCAN_SECONDS):
+        self.root = root
+        self.rescan_seconds = rescan_seconds
+        self.lock = threading.Lock()
+        self.records = []
+        self.by_name = {}
+        self.version = None
+        self.dir_mtime = None
+        self.scanned_at = 0.0
+
+    @staticmethod
+    def _hash_file(path):
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(block)
+        return hasher.hexdigest()
+
+    def _scan(self):
+        records = []
+        for entry in sorted(os.scandir(self.root), key=lambda entry: entry.name):
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            stat = entry.stat()
+            previous = self.by_name.get(entry.name)
+            if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+                records.append(previous)
+                continue
+            records.append({
+                "name": entry.name,
+                "size": stat.st_size,
+                "mtime": int(stat.st_mtime),
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": self._hash_file(entry.path),
+                "mime": mimetypes.guess_type(entry.name)[0] or "application/octet-stream",
+                "url": f"/records/{entry.name}",
+            })
+        self.records = records
+        self.by_name = {record["name"]: record for record in records}
+        self.version = hashlib.sha256("".join(record["sha256"] + record["name"] for record in records).encode()).hexdigest()[:16]
+
+    def refresh(self):
+        now = time.monotonic()
+        dir_mtime = os.stat(self.root).st_mtime_ns
+        if dir_mtime == self.dir_mtime and now - self.scanned_at < self.rescan_seconds:
+            return
+        with self.lock:
+            if dir_mtime != self.dir_mtime or now - self.scanned_at >= self.rescan_seconds:
+                self._scan()
+                self.dir_mtime = dir_mtime
+                self.scanned_at = now
+
+    def get(self, name):
+        self.refresh()
+        return self.by_name.get(name)
+
+    def page(self, page, page_size):
+        self.refresh()
+        start = (page - 1) * page_size
+        return self.records[start:start + page_size], len(self.records), self.version
+
+record_index = RecordIndex(SAMPLE_DATA_DIR)
+
+gzip_cache = OrderedDict()  # sha256 -> compressed bytes
+gzip_cache_lock = threading.Lock()
+
+def gzipped(record):
+    with gzip_cache_lock:
+        body = gzip_cache.get(record["sha256"])
+        if body is not None:
+            gzip_cache.move_to_end(record["sha256"])
+            return body
+    with open(os.path.join(SAMPLE_DATA_DIR, record["name"]), "rb") as f:
+        body = gzip.compress(f.read(), compresslevel=6, mtime=0)
+    with gzip_cache_lock:
+        gzip_cache[record["sha256"]] = body
+        while len(gzip_cache) > GZIP_CACHE_ENTRIES:
+            gzip_cache.popitem(last=False)
+    return body
+
+def wants_gzip(record):
+    return (
+        GZIP_ENABLED
+        and record["mime"].startswith(GZIP_TYPES)
+        and GZIP_MIN_BYTES <= record["size"] <= GZIP_MAX_BYTES
+        # Ranges are always served against the identity encoding
+        and "Range" not in request.headers
+        and "gzip" in request.headers.get("Accept-Encoding", "")
+    )
+
+def serve_record(record):
+    path = os.path.join(SAMPLE_DATA_DIR, record["name"])
+    if wants_gzip(record):
+        response = app.response_class(gzipped(record), mimetype=record["mime"])
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Content-Disposition"] = f'attachment; filename="{record["name"]}"'
+        # The compressed variant is a different representation, so it needs its own strong ETag
+        response.set_etag(f"{record['sha256']}-gzip")
+        response.last_modified = record["mtime"]
+        response = response.make_conditional(request)
+    else:
+        # conditional=True handles If-None-Match (304), Range/If-Range (206) and Accept-Ranges
+        response = send_file(
+            path,
+            mimetype=record["mime"],
+            as_attachment=True,
+            download_name=record["name"],
+            etag=record["sha256"],
+            last_modified=record["mtime"],
+            conditional=True,
+        )
+    response.vary.add("Accept-Encoding")
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/manifest', methods=['GET'])
+def get_manifest():
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        page_size = min(max(int(request.args.get("page_size", MANIFEST_DEFAULT_PAGE_SIZE)), 1), MANIFEST_MAX_PAGE_SIZE)
+    except ValueError:
+        return "page and page_size must be integers", 400
+
+    records, total, version = record_index.page(page, page_size)
+    response = jsonify({
+        "version": version,
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "next_page": page + 1 if page * page_size < total else None,
+        "records": [{key: value for key, value in record.items() if key != "mtime_ns"} for record in records],
+    })
+    response.set_etag(f"{version}-{page}-{page_size}")
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/get_sample_data', methods=['GET'])
 def get_sample_data():
     try:
-        docx_path = os.path.join(SAMPLE_DATA_DIR, "patient_report.docx")
-        pdf_path = os.path.join(SAMPLE_DATA_DIR, "patient_report.pdf")
-        image_path = os.path.join(SAMPLE_DATA_DIR, "rainfall.jpg")
-        text_path = os.path.join(SAMPLE_DATA_DIR, "test.txt")
-        
-        if not all(os.path.exists(path) for path in [docx_path, pdf_path, image_path]):
+        if not all(record_index.get(LEGACY_FILES[file_type]) for file_type in ("docx", "pdf", "image")):
             return "One or more sample files are missing", 404
-        
+
         return {
             "docx_file": f"/download/docx",
             "pdf_file": f"/download/pdf",
@@ -25,18 +188,21 @@ def get_sample_data():
     except Exception as e:
         return str(e), 500
 
+@app.route('/records/<name>', methods=['GET'])
+def download_record(name):
+    record = record_index.get(name)
+    if record is None:
+        return "Record not found", 404
+    return serve_record(record)
+
 @app.route('/download/<file_type>', methods=['GET'])
 def download_file(file_type):
-    if file_type == 'docx':
-        return send_file(os.path.join(SAMPLE_DATA_DIR, "patient_report.docx"), as_attachment=True)
-    elif file_type == 'pdf':
-        return send_file(os.path.join(SAMPLE_DATA_DIR, "patient_report.pdf"), as_attachment=True)
-    elif file_type == 'image':
-        return send_file(os.path.join(SAMPLE_DATA_DIR, "rainfall.jpg"), as_attachment=True)
-    elif file_type == 'txt':
-        return send_file(os.path.join(SAMPLE_DATA_DIR, "test.txt"), as_attachment=True)
-    else:
+    if file_type not in LEGACY_FILES:
         return "Invalid file type", 400
+    record = record_index.get(LEGACY_FILES[file_type])
+    if record is None:
+        return "Record not found", 404
+    return serve_record(record)
 
 if __name__ == '__main__':
-    app.run(port=5000)
\ No newline at end of file
+    app.run(port=5000)